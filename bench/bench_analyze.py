@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Compares the wall-clock time of the fused analyzer (analyze.py) with
+that of the separate sentiment and word-association analyses, which
+each tokenize and attribute the sentences of a story on their own.
+
+Both are timed in-process, which shows the saving of the shared
+tokenization and attribution, and as scripts, one process per analysis
+per story, as the Makefile used to run them.
+"""
+
+import os, shutil, subprocess, sys, tempfile, time
+
+src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, src)
+import analyze_senti
+from analyze import analyze
+from analyze_words import analyze_words
+from common import files_of_type
+
+def in_process(paths):
+    """Return the seconds taken by (separate, fused) analyses of paths.
+    Each starts with an empty sentence score cache, so that neither
+    reuses the scores of the other.
+    """
+    analyze_senti.score_cache = analyze_senti.ScoreCache()
+    start = time.time()
+    for path in paths:
+        with open(path) as f:
+            analyze_senti.analyze_senti(f)
+        with open(path) as f:
+            analyze_words(f)
+    separate = time.time() - start
+    analyze_senti.score_cache = analyze_senti.ScoreCache()
+    start = time.time()
+    for path in paths:
+        with open(path) as f:
+            analyze(f)
+    return separate, time.time() - start
+
+def as_scripts(paths, out_dir):
+    """Return the seconds taken by (separate, fused) runs of the scripts
+    over paths, writing their output to out_dir
+    """
+    def run(script, *args):
+        subprocess.run([sys.executable, os.path.join(src, script)] + list(args), check=True)
+    start = time.time()
+    for i, path in enumerate(paths):
+        run("analyze_senti.py", path, os.path.join(out_dir, "%d.sentiment.json" % i))
+        run("analyze_words.py", path, os.path.join(out_dir, "%d.words.json" % i))
+    separate = time.time() - start
+    start = time.time()
+    for i, path in enumerate(paths):
+        # A copy of the text, so that analyze.py can't reuse the sentence
+        # index of an earlier run
+        copy = os.path.join(out_dir, "%d.ansi.txt" % i)
+        shutil.copyfile(path, copy)
+        run("analyze.py", "--json", copy, os.path.join(out_dir, "%d.sentiment.json" % i),
+            os.path.join(out_dir, "%d.words.json" % i))
+    return separate, time.time() - start
+
+def report(name, separate, fused):
+    print("{}: separate {:.2f} s, fused {:.2f} s ({:.0%} saved)".format(
+        name, separate, fused, 1 - fused/separate))
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: {} <dir of .ansi.txt stories> [<max stories>]".format(sys.argv[0]))
+    else:
+        paths = sorted(files_of_type(sys.argv[1], ".ansi.txt"))
+        if len(sys.argv) == 3:
+            paths = paths[:int(sys.argv[2])]
+        print("{} stories, {:.1f} MB".format(len(paths), sum(os.path.getsize(p) for p in paths)/1e6))
+        # Warm up the models, so that neither side pays for loading them
+        in_process(paths[:1])
+        report("in-process", *in_process(paths))
+        with tempfile.TemporaryDirectory() as out_dir:
+            report("scripts", *as_scripts(paths, out_dir))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Compares common.attribute_sentence_to_char with the nested loop it
+replaced, on the sentences of a story.
+"""
+
+import os, sys, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from common import attribute_sentence_to_char, characters_plus_text
+from sentences import iter_sentences
+
+def original_attribute_sentence_to_char(sentence, chars=characters_plus_text, replace=True):
+    """attribute_sentence_to_char as it was: an `in` check for every
+    nickname and a str.replace per character found
+    """
+    c_in_s = {}
+    for c, nicks in characters_plus_text.items():
+        for nick in nicks:
+            if nick in sentence:
+                c_in_s[c] = nick
+                break
+
+    if replace:
+        for nick in c_in_s.values():
+            sentence = sentence.replace(nick, "it")
+
+    return c_in_s.keys(), sentence
+
+def run(attribute, sentences):
+    for s in sentences:
+        attribute(s)
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: {} <input txt file> [<repeats>]".format(sys.argv[0]))
+    else:
+        sentences = list(iter_sentences(open(sys.argv[1])))
+        repeats = int(sys.argv[2]) if len(sys.argv) == 3 else 5
+        results = [(original_attribute_sentence_to_char(s), attribute_sentence_to_char(s)) for s in sentences]
+        named = sum(bool(new[0]) for old, new in results)
+        same_chars = sum(set(old[0]) == set(new[0]) for old, new in results)
+        same_text = sum(old[1] == new[1] for old, new in results)
+        print("{} sentences, {} naming a character; same characters for {}, same text for {}".format(
+            len(sentences), named, same_chars, same_text))
+        for name, attribute in (("original", original_attribute_sentence_to_char),
+                ("compiled", attribute_sentence_to_char)):
+            best = min(timeit.repeat(lambda: run(attribute, sentences), number=1, repeat=repeats))
+            print("{}: {:.3f} s, {:.2f} us per sentence".format(name, best, best/len(sentences)*1e6))
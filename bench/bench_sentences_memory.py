@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Measures the peak RSS of splitting stories of growing length into
+sentences, streamed by sentences.iter_sentences or all at once with
+sent_tokenize(f.read()), as the analyzers used to.
+
+The stories are made by repeating a sample text, and each measurement is
+taken in a fresh process, after the imports, which are measured alone
+for reference.
+"""
+
+import os, resource, subprocess, sys, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+def peak_rss():
+    """Return the peak RSS of this process, in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+def measure(mode, path):
+    """Split the text at path into sentences the way mode says and print
+    the number of sentences and the peak RSS
+    """
+    from nltk import tokenize
+    from sentences import iter_sentences, punkt_tokenizer
+    # Load the model before anything is measured
+    punkt_tokenizer().tokenize("Warm up. Done.")
+    count = 0
+    if mode == "stream":
+        with open(path) as f:
+            for s in iter_sentences(f):
+                count += 1
+    elif mode == "whole":
+        with open(path) as f:
+            count = len(tokenize.sent_tokenize(f.read()))
+    print(count, peak_rss())
+
+def run(mode, path):
+    """Return (sentences, peak RSS in MB) of measure(mode, path) in a new process"""
+    out = subprocess.run([sys.executable, __file__, "--measure", mode, path],
+        check=True, capture_output=True, text=True).stdout.split()
+    return int(out[0]), float(out[1])
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--measure":
+        measure(*sys.argv[2:])
+    elif len(sys.argv) not in (2, 3):
+        print("Usage: {} <sample txt file> [<largest story size in MB>]".format(sys.argv[0]))
+    else:
+        sample = open(sys.argv[1]).read()
+        largest = float(sys.argv[2]) if len(sys.argv) == 3 else 64
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "story.ansi.txt")
+            repeats = 1
+            print("{:>8} {:>10} {:>12} {:>12} {:>12}".format("MB", "sentences", "imports MB", "stream MB", "whole MB"))
+            while repeats == 1 or repeats*len(sample) <= largest*1e6:
+                with open(path, "w") as f:
+                    for _ in range(repeats):
+                        f.write(sample + "\n")
+                count, stream = run("stream", path)
+                _, whole = run("whole", path)
+                _, imports = run("imports", path)
+                print("{:>8.1f} {:>10} {:>12.0f} {:>12.0f} {:>12.0f}".format(
+                    os.path.getsize(path)/1e6, count, imports, stream, whole))
+                repeats *= 4
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Compares aggregate.avg_data_at_percents, which averages a story's
+sentence sentiments at every percent through it with one cumulative sum,
+with the loop it replaced, which averaged the slice of every percent in
+turn. The stories are random sentiment series of growing length.
+"""
+
+import os, random, sys, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from aggregate import avg_data_at_percents
+
+def average(data):
+    s = 0
+    n = 0
+    for i in data:
+        s += i
+        n += 1
+    return s/max(n, 1)
+
+def avg_data_at_percent(data, percent):
+    """The average of data at percent as aggregate computed it, one
+    slice at a time
+    """
+    idx_start = max(0, int((percent-0.5)*len(data)/100))
+    idx_end = min(len(data), int((percent+0.5)*len(data)/100))
+    idx_end = max(idx_start+1, idx_end) # need at least one sample.
+    return average(data[idx_start:idx_end])
+
+def original(data, arcs):
+    """Add the story arc of data to each dict of arcs, as aggregate did"""
+    for percent in range(101):
+        arc_senti = avg_data_at_percent(data, percent)
+        for arc in arcs:
+            arc[percent]["sum"] += arc_senti
+            arc[percent]["count"] += 1
+
+def cumsum(data, sums, counts):
+    """Add the story arc of data to each of the arrays sums, as aggregate does"""
+    arc_senti = avg_data_at_percents(data)
+    for name in sums:
+        sums[name] += arc_senti
+        counts[name] += 1
+
+def best_time(f, *args, repeat=5):
+    """Return the least seconds taken by f(*args) in repeat runs"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (1, 2):
+        print("Usage: {} [<longest story in sentences>]".format(sys.argv[0]))
+    else:
+        longest = int(sys.argv[1]) if len(sys.argv) == 2 else 150000
+        rng = random.Random(0)
+        print("{:>10} {:>12} {:>12} {:>8}".format("sentences", "loop ms", "cumsum ms", "speedup"))
+        lengths = sorted({n for n in (100, 1000, 10000, 100000) if n < longest} | {longest})
+        for length in lengths:
+            # Sentiments were a list read from JSON; they are now a float32
+            # array read from a .results file
+            data = [round(rng.uniform(-1, 1), 4) for _ in range(length)]
+            array = np.asarray(data, dtype="<f4")
+            # A story counts towards the overall arc and that of its length
+            arcs = [[{"sum": 0, "count": 0} for _ in range(101)] for _ in range(2)]
+            sums = {name: np.zeros(101) for name in ("all", "length")}
+            counts = {name: np.zeros(101, dtype=np.int64) for name in sums}
+            original(array.tolist(), arcs)
+            cumsum(array, sums, counts)
+            # The sums are added up in a different order
+            np.testing.assert_allclose(sums["all"], [a["sum"] for a in arcs[0]], rtol=0, atol=1e-9)
+            loop = best_time(original, array.tolist(), arcs)
+            fast = best_time(cumsum, array, sums, counts)
+            print("{:>10} {:>12.3f} {:>12.3f} {:>7.1f}x".format(length, loop*1e3, fast*1e3, loop/fast))
@@ -1,152 +1,593 @@
 #!/usr/bin/env python3
 """Take precompiled statistics of each indivual story and draw
 conclusions of the entire set, or on individual authors, etc.
+
+Stories are aggregated in shards of consecutive story ids. Each shard
+is aggregated on its own (possibly in a worker process) and the partial
+aggregates are then merged in a fixed order, so the output is the same
+however many workers are used.
 """
 
-import json, os, sys
+import json, multiprocessing, os, sys
+import numpy as np
+
+from common import characters, characters_plus_text, files_of_type, story_length, write_atomic
+from index_table import IndexTable
+from membership import membership_table, table_members
+from results import read_results
+from store import write_store
+
+# Number of consecutive story ids aggregated together
+shard_size = 1000
+
+def story_paths(srcdir):
+    """Return {story_id: path} of the results of every analyzed story in
+    srcdir: its .results file, or its .sentiment.json file if it has none.
+    """
+    paths = {}
+    for p in files_of_type(srcdir, ".sentiment.json"):
+        paths[story_id_of(p, ".sentiment.json")] = p
+    for p in files_of_type(srcdir, ".results"):
+        paths[story_id_of(p, ".results")] = p
+    return paths
 
-from common import characters_plus_text, story_length
+def load_story(path):
+    """Return the (sentiment dict, word-association dict) stored at path.
+    The associations of .results files are read in sparse form (see
+    results.read_results).
+    """
+    if path.endswith(".results"):
+        return read_results(path, sparse=True)
+    p_words = path.replace(".sentiment.json", ".words.json")
+    return json.loads(open(path, "r").read()), json.loads(open(p_words, "r").read())
 
-def average(data):
-    s = 0
-    n = 0
-    for i in data:
-        s += i
-        n += 1
-    return s/max(n, 1)
+def story_id_of(path, ext):
+    # Special thanks to this story by Sharp Spark for having not
+    # a single English character in his title, making parsing the
+    # id excessively complicated: https://www.fimfiction.net/story/269475
+    return path.split("/")[-1].replace(ext, "").split("-")[-1]
 
-def files_of_type(srcdir, ext):
-    for root, dirs, files in os.walk(srcdir):
-        for f in files:
-            if f.endswith(ext):
-                yield os.path.join(root, f)
+def shards_of(story_ids):
+    """Split story_ids into a list of (shard number, shard) in order, where
+    each shard is a list of consecutive story ids.
+    """
+    shards = {}
+    for story_id in sorted(story_ids, key=int):
+        shards.setdefault(int(story_id)//shard_size, []).append(story_id)
+    return sorted(shards.items())
 
-def avg_data_at_percent(data, percent):
-    """Given an array of numbers, return the average value at any percent in the data.
-    0 and 100 (percent) are inclusive. This is done by making the first
-    and last percent on half-length.
+def fingerprint(pub_date, path):
+    """Return everything the aggregate of a story depends on (as a JSON
+    friendly list), to tell whether it changed since the last run.
     """
-    idx_start = max(0, int((percent-0.5)*len(data)/100))
-    idx_end = min(len(data), int((percent+0.5)*len(data)/100))
-    idx_end = max(idx_start+1, idx_end) # need at least one sample.
-    return average(data[idx_start:idx_end])
+    files = [path]
+    if path.endswith(".sentiment.json"):
+        files.append(path.replace(".sentiment.json", ".words.json"))
+    stats = [[p, st.st_size, st.st_mtime_ns] for p, st in ((p, os.stat(p)) for p in files)]
+    return [stats, pub_date]
 
-def aggregate(index, src_paths):
-    """Perform several analyses on the .json results in src_paths.
+def sparse_associations(datum_words):
+    """Return (words, {char: (indices into words, counts)}) of a story's
+    word associations, in either layout returned by load_story.
     """
-    results = {}
-    sentiment = {}
-    # Number of times each character is mentioned by name
-    char_mentions = {}
+    if "words" in datum_words:
+        return datum_words["words"], datum_words["associations"]
+    vocab = {}
     associations = {}
-    # "char1,char2": {"in_a_sentence": <int>, "in_a_story": <int>}
-    char_pairs = {}
-    results["sentiment"] = sentiment
-    results["story_lengths"] = []
-    results["char_mentions"] = char_mentions
-    results["associations"] = associations
-    results["char_pairs"] = char_pairs
-    for c in tuple(characters_plus_text.keys()):
-        # Each month contains a sum of sentiment and a count of sentiments
-        # which can be used to derive the average
-        sentiment[c] = {
-            # average sentence sentiment by month since Jan 2010
-            "months": [ {"sum": 0, "count": 0} for i in range(100)],
-            # Average sentence sentiment at any point through a story.
-            "storyarc_percent": [ {"sum": 0, "count": 0} for i in range(101)],
-            # Short-format (<= N sentences), medium, long-format stories
-            "storyarc_percent_short": [ {"sum": 0, "count": 0} for i in range(101)],
-            "storyarc_percent_med": [ {"sum": 0, "count": 0} for i in range(101)],
-            "storyarc_percent_long": [ {"sum": 0, "count": 0} for i in range(101)],
-        }
-        char_mentions[c] = {
-            "in_a_sentence": 0,
-            # Count of # of stories the character appears (redundant)
-            "in_a_story": 0,
-            # map story_id -> # of sentences in which char appears
-            "in_stories": {},
-        }
-        # "word": <int>
-        associations[c] = {}
-
-    for srcno, p_senti in enumerate(src_paths):
-        if srcno % 10000 == 0: print('story:', srcno)
-        # Special thanks to this story by Sharp Spark for having not
-        # a single English character in his title, making parsing the
-        # id excessively complicated: https://www.fimfiction.net/story/269475
-        story_id = p_senti.split("/")[-1].replace(".sentiment.json","").split("-")[-1]
-        story_meta = index[story_id]
-        datum_senti = json.loads(open(p_senti, "r").read())
-        p_words = p_senti.replace(".sentiment.json", ".words.json")
-        datum_words = json.loads(open(p_words, "r").read())
+    for c, counts in datum_words["associations"].items():
+        idx = [vocab.setdefault(w, len(vocab)) for w in counts]
+        associations[c] = np.array(idx, dtype=np.int64), np.array(list(counts.values()), dtype=np.int64)
+    return list(vocab), associations
+
+percents = np.arange(101)
+
+def avg_data_at_percents(data):
+    """Given an array of numbers, return the average value at every
+    percent from 0 to 100 through the data, as an array, using a single
+    cumulative sum of data. The average at percent p is that of the
+    samples from p-0.5% to p+0.5% of the way through (and at least one),
+    so the first and last percents are half-length.
+    """
+    idx_start = np.maximum(0, ((percents-0.5)*len(data)/100).astype(int))
+    idx_end = np.minimum(len(data), ((percents+0.5)*len(data)/100).astype(int))
+    idx_end = np.maximum(idx_start+1, idx_end) # need at least one sample.
+    # Summed in double precision: data may be a float32 array, whose
+    # cumulative sum would lose the averages of long stories
+    cumsum = np.concatenate(([0.0], np.cumsum(data, dtype=float)))
+    return (cumsum[idx_end] - cumsum[idx_start]) / (idx_end - idx_start)
 
+# Name and number of buckets of each sentiment series
+sentiment_series = {
+    # average sentence sentiment by month since Jan 2010
+    "months": 100,
+    # Average sentence sentiment at any point through a story.
+    "storyarc_percent": 101,
+    # Short-format (<= N sentences), medium, long-format stories
+    "storyarc_percent_short": 101,
+    "storyarc_percent_med": 101,
+    "storyarc_percent_long": 101,
+}
+
+class Aggregate:
+    """Aggregated statistics of a set of stories. The aggregates of two
+    disjoint sets of stories can be merged into that of their union.
+
+    If max_words is given, only the most common words associated with
+    each character are kept track of (between max_words and twice that
+    many), so the memory used no longer grows with the long tail of
+    rare words and typos. The counts are then upper bounds, as in the
+    Space-Saving algorithm: a word which isn't tracked is counted as if
+    it had been seen as often as the most common word dropped so far.
+    See association_errors for how far off they may be.
+    """
+    def __init__(self, max_words=None):
+        # Each bucket of a sentiment series has a sum of sentiment and a
+        # count of sentiments which can be used to derive the average.
+        # These are stored as (character x bucket) arrays, the rows being
+        # in the order of characters_plus_text.
+        num_chars = len(characters_plus_text)
+        self.sentiment_sum = {name: np.zeros((num_chars, size))
+            for name, size in sentiment_series.items()}
+        self.sentiment_count = {name: np.zeros((num_chars, size), dtype=np.int64)
+            for name, size in sentiment_series.items()}
+        self.story_lengths = []
+        # Id of each story, in the same order. Stories are referred to by
+        # their row in this list.
+        self.story_ids = []
+        # Number of times each character is mentioned by name
+        self.char_mentions = {}
+        # char -> ([rows of stories in which char appears], [# of
+        # sentences in which char appears in each]), see membership.py
+        self.char_stories = {}
+        # word -> id, in order of first appearance
+        self.vocab = {}
+        # (character x word id) number of stories in which the word is
+        # associated with the character. Has room for more words than
+        # are in vocab.
+        self.associations = np.zeros((num_chars, 1024), dtype=np.int32)
+        self.max_words = max_words
+        if max_words is not None:
+            # How much each count may be over the real one
+            self.associations_error = np.zeros_like(self.associations)
+            # The most any untracked word may have been seen
+            self.untracked_max = np.zeros(num_chars, dtype=np.int64)
+            # Number of tracked words
+            self.num_tracked = np.zeros(num_chars, dtype=np.int64)
+        # "char1,char2": {"in_a_sentence": <int>, "in_a_story": <int>}
+        self.char_pairs = {}
+        # Same as char_stories, for the pairs
+        self.pair_stories = {}
+        for c in tuple(characters_plus_text.keys()):
+            self.char_mentions[c] = {
+                "in_a_sentence": 0,
+                # Count of # of stories the character appears (redundant)
+                "in_a_story": 0,
+            }
+            self.char_stories[c] = ([], [])
+
+    def add_story(self, story_id, pub_date, datum_senti, datum_words):
+        """Add the analysis results of a single story, whose average
+        publication date (see index_table.average_date) is pub_date.
+        """
+        sums = self.sentiment_sum
+        counts = self.sentiment_count
+        char_mentions = self.char_mentions
         num_sentences = len(datum_senti["sentiment"]["text"]["raw"])
-        # Sentiment data is unavailable on a per-chapter basis, so
-        # we generalize them to the average publication date.
-        avg_pub_date = average(ch["date_modified"] for ch in story_meta["chapters"])
         # number of months since 2010
-        pub_month = int(12*(avg_pub_date / (60*60*24*365.25) - 40))
+        pub_month = int(12*(pub_date / (60*60*24*365.25) - 40))
 
-        results["story_lengths"].append(num_sentences)
+        row = len(self.story_ids)
+        self.story_ids.append(story_id)
+        self.story_lengths.append(num_sentences)
+
+        # Determine which storyarc sets this story applies to
+        if num_sentences <= story_length.short:
+            apropo_sets = ("storyarc_percent", "storyarc_percent_short")
+        elif num_sentences <= story_length.med:
+            apropo_sets = ("storyarc_percent", "storyarc_percent_med")
+        else:
+            apropo_sets = ("storyarc_percent", "storyarc_percent_long")
 
         # aggregate the sentiments
-        for c in tuple(characters_plus_text.keys()):
-            senti = datum_senti["sentiment"][c]["raw"]
-            if senti:
+        for ci, c in enumerate(characters_plus_text):
+            senti = np.asarray(datum_senti["sentiment"][c]["raw"], dtype=float)
+            if len(senti):
                 # The character's score would default to 0 if
                 # the character flat-out doesn't ever appear in
                 # the story; although this is OK for most measurements,
                 # it would incorrectly drag down the character's
                 # portrayal based on percentage into the story
                 # (sentiment[c]["storyarc_percent_x"])
-                sentiment[c]["months"][pub_month]["sum"] += sum(senti)
-                sentiment[c]["months"][pub_month]["count"] += len(senti)
+                sums["months"][ci, pub_month] += senti.sum()
+                counts["months"][ci, pub_month] += len(senti)
 
                 char_mentions[c]["in_a_sentence"] += len(senti)
-                char_mentions[c]["in_a_story"] += bool(senti)
-                char_mentions[c]["in_stories"][story_id] = len(senti)
-
-                # Determine which storyarc sets this story applies to
-                apropo_sets = [sentiment[c]["storyarc_percent"]]
-                if num_sentences <= story_length.short:
-                    apropo_sets.append(sentiment[c]["storyarc_percent_short"])
-                elif num_sentences <= story_length.med:
-                    apropo_sets.append(sentiment[c]["storyarc_percent_med"])
-                else:
-                    apropo_sets.append(sentiment[c]["storyarc_percent_long"])
-
-                for percent in range(101):
-                    arc_senti = avg_data_at_percent(senti, percent)
-                    for arcs in apropo_sets:
-                        arcs[percent]["sum"] += arc_senti
-                        arcs[percent]["count"] += 1
+                char_mentions[c]["in_a_story"] += 1
+                self.char_stories[c][0].append(row)
+                self.char_stories[c][1].append(len(senti))
+
+                arc_senti = avg_data_at_percents(senti)
+                for name in apropo_sets:
+                    sums[name][ci] += arc_senti
+                    counts[name][ci] += 1
 
         # Aggregate the character pairs
         for char_pair, count in datum_words["char_pairs"].items():
-            it = char_pairs.get(char_pair,
-                dict(in_a_story=0, in_a_sentence=0, in_stories={}))
+            it = self.char_pairs.get(char_pair,
+                dict(in_a_story=0, in_a_sentence=0))
             it["in_a_sentence"] += count
             it["in_a_story"] += 1
-            it["in_stories"][story_id] = count
-            char_pairs[char_pair] = it
+            self.char_pairs[char_pair] = it
+            rows, counts = self.pair_stories.setdefault(char_pair, ([], []))
+            rows.append(row)
+            counts.append(count)
 
         # Aggregate the word associations
-        for char in characters_plus_text:
-            for word in datum_words["associations"][char]:
-                num_seen = associations[char].get(word, 0)
-                associations[char][word] = num_seen + 1
+        words, associations = sparse_associations(datum_words)
+        ids = self._word_ids(words)
+        for ci, c in enumerate(characters_plus_text):
+            # Each word is listed at most once per character
+            char_ids = ids[associations[c][0]]
+            if self.max_words is None:
+                self.associations[ci, char_ids] += 1
+                continue
+            row = self.associations[ci]
+            new = char_ids[row[char_ids] == 0]
+            row[new] = self.associations_error[ci, new] = self.untracked_max[ci]
+            row[char_ids] += 1
+            self.num_tracked[ci] += len(new)
+        if self.max_words is not None:
+            # Pruning renumbers the words, so only once ids is done with
+            for ci in np.flatnonzero(self.num_tracked > 2*self.max_words):
+                self._prune(ci)
+
+    def _word_ids(self, words):
+        """Return the array of ids of words, adding new ones to the vocabulary"""
+        vocab = self.vocab
+        ids = np.fromiter((vocab.setdefault(w, len(vocab)) for w in words),
+            dtype=np.int64, count=len(words))
+        if len(vocab) > self.associations.shape[1]:
+            self._resize(np.arange(self.associations.shape[1]), 2*len(vocab))
+        return ids
 
+    def _resize(self, keep, size):
+        """Keep only the word ids keep, renumbered in order, with room for size words"""
+        self.associations = self._resized(self.associations, keep, size)
+        if self.max_words is not None:
+            self.associations_error = self._resized(self.associations_error, keep, size)
 
-    return results
+    @staticmethod
+    def _resized(matrix, keep, size):
+        resized = np.zeros((matrix.shape[0], size), dtype=matrix.dtype)
+        resized[:, :len(keep)] = matrix[:, keep]
+        return resized
+
+    def _prune(self, ci):
+        """Stop tracking all but the max_words most common words of
+        character number ci
+        """
+        row = self.associations[ci, :len(self.vocab)]
+        tracked = np.flatnonzero(row)
+        if len(tracked) > self.max_words:
+            # The first seen of equally common words are kept
+            dropped = tracked[np.argsort(-row[tracked], kind="stable")[self.max_words:]]
+            self.untracked_max[ci] = max(self.untracked_max[ci], row[dropped].max())
+            row[dropped] = 0
+            self.associations_error[ci, dropped] = 0
+        self.num_tracked[ci] = min(len(tracked), self.max_words)
+        # Forget the words no character tracks any more
+        if len(self.vocab) > 2*self.num_tracked.sum():
+            words = list(self.vocab)
+            keep = np.flatnonzero(self.associations[:, :len(words)].any(axis=0))
+            self.vocab = {words[i]: n for n, i in enumerate(keep.tolist())}
+            self._resize(keep, max(1024, 2*len(keep)))
+
+    def association_errors(self):
+        """Return, for each character, how accurate its word counts are:
+        untracked_max, the most any word missing from its associations may
+        have been seen; max_error, the most any count may be over the real
+        one; and certain_top, the number of most common words which are
+        certain to be the most common ones (in some order).
+        """
+        errors = {}
+        for ci, c in enumerate(characters_plus_text):
+            row = self.associations[ci, :len(self.vocab)]
+            ids = np.flatnonzero(row)
+            ids = ids[np.argsort(-row[ids], kind="stable")]
+            upper = row[ids].astype(np.int64)
+            lower = upper - self.associations_error[ci, ids]
+            # The first k words are the top k if the least any of them was
+            # seen is at least the most any other word was seen
+            rest_max = np.maximum.accumulate(np.append(upper, self.untracked_max[ci])[::-1])[::-1][1:]
+            certain = np.minimum.accumulate(lower) >= rest_max
+            errors[c] = dict(untracked_max=int(self.untracked_max[ci]),
+                max_error=int(self.associations_error[ci, ids].max(initial=0)),
+                certain_top=int(np.argmin(certain)) if not certain.all() else len(ids))
+        return errors
+
+    def pooled_frequencies(self):
+        """Return the frequency of each word id among the words of the
+        sentences mentioning any character (not "text"), counting each
+        character's sentences separately.
+        """
+        ci = [ci for ci, c in enumerate(characters_plus_text) if c in characters]
+        counts = self.associations[ci, :len(self.vocab)].sum(axis=0, dtype=np.int64)
+        return counts / max(1, counts.sum())
+
+    def merge(self, other):
+        """Add the aggregate of another, disjoint, set of stories to this
+        one. other may share state with the result, so it shouldn't be
+        used afterwards. Returns self.
+        """
+        for name in sentiment_series:
+            self.sentiment_sum[name] += other.sentiment_sum[name]
+            self.sentiment_count[name] += other.sentiment_count[name]
+        # The other's stories come after ours
+        offset = len(self.story_ids)
+        self.story_ids.extend(other.story_ids)
+        self.story_lengths.extend(other.story_lengths)
+        for c, mentions in other.char_mentions.items():
+            mine = self.char_mentions[c]
+            mine["in_a_sentence"] += mentions["in_a_sentence"]
+            mine["in_a_story"] += mentions["in_a_story"]
+        for char_pair, theirs in other.char_pairs.items():
+            mine = self.char_pairs.get(char_pair)
+            if mine is None:
+                self.char_pairs[char_pair] = theirs
+            else:
+                mine["in_a_sentence"] += theirs["in_a_sentence"]
+                mine["in_a_story"] += theirs["in_a_story"]
+        for members, other_members in ((self.char_stories, other.char_stories),
+                (self.pair_stories, other.pair_stories)):
+            for name, (rows, counts) in other_members.items():
+                mine = members.setdefault(name, ([], []))
+                mine[0].extend(r + offset for r in rows)
+                mine[1].extend(counts)
+        ids = self._word_ids(list(other.vocab))
+        if self.max_words is None:
+            self.associations[:, ids] += other.associations[:, :len(ids)]
+            return self
+        n = len(self.vocab)
+        mine, mine_error = self.associations[:, :n], self.associations_error[:, :n]
+        theirs, theirs_error = np.zeros_like(mine), np.zeros_like(mine)
+        theirs[:, ids] = other.associations[:, :len(ids)]
+        theirs_error[:, ids] = other.associations_error[:, :len(ids)]
+        # A word only one side tracks may have been seen as often as the
+        # most common untracked word of the other
+        mine_max, theirs_max = self.untracked_max[:, None], other.untracked_max[:, None]
+        tracked = (mine > 0) | (theirs > 0)
+        counts = np.where(mine > 0, mine, mine_max) + np.where(theirs > 0, theirs, theirs_max)
+        errors = np.where(mine > 0, mine_error, mine_max) + np.where(theirs > 0, theirs_error, theirs_max)
+        self.associations[:, :n] = np.where(tracked, counts, 0)
+        self.associations_error[:, :n] = np.where(tracked, errors, 0)
+        self.untracked_max += other.untracked_max
+        self.num_tracked = tracked.sum(axis=1)
+        for ci in range(len(characters_plus_text)):
+            if self.num_tracked[ci] > self.max_words:
+                self._prune(ci)
+        return self
+
+    def save(self, path):
+        # The vocabulary is saved too, so that word ids come out the same
+        saved = dict(self.results(), vocab=list(self.vocab))
+        if self.max_words is not None:
+            saved["untracked_max"] = self.untracked_max.tolist()
+            saved["errors"] = {c: self.associations_error[ci, np.flatnonzero(self.associations[ci, :len(self.vocab)])].tolist()
+                for ci, c in enumerate(characters_plus_text)}
+        write_atomic(path, json.dumps(saved))
+
+    def load(self, path):
+        results = json.loads(open(path, "r").read())
+        for ci, c in enumerate(characters_plus_text):
+            for name in sentiment_series:
+                buckets = results["sentiment"][c][name]
+                self.sentiment_sum[name][ci] = [b["sum"] for b in buckets]
+                self.sentiment_count[name][ci] = [b["count"] for b in buckets]
+        self.story_lengths = results["story_lengths"]
+        self.story_ids = results["stories"]
+        self.char_mentions = results["char_mentions"]
+        self.char_stories = table_members(results["char_stories"])
+        self.pair_stories = table_members(results["pair_stories"])
+        self.vocab = {}
+        self._resize([], 1024)
+        self._word_ids(results["vocab"])
+        for ci, c in enumerate(characters_plus_text):
+            counts = results["associations"][c]
+            ids = self._word_ids(list(counts))
+            self.associations[ci, ids] = list(counts.values())
+            if self.max_words is not None:
+                self.associations_error[ci, ids] = results["errors"][c]
+                self.num_tracked[ci] = len(ids)
+        if self.max_words is not None:
+            self.untracked_max[:] = results["untracked_max"]
+        self.char_pairs = results["char_pairs"]
+
+    def results(self):
+        """Return the aggregate in the layout of aggregated.json"""
+        sentiment = {}
+        for ci, c in enumerate(characters_plus_text):
+            sentiment[c] = {name: [{"sum": total, "count": count} for total, count in
+                    zip(self.sentiment_sum[name][ci].tolist(), self.sentiment_count[name][ci].tolist())]
+                for name in sentiment_series}
+        # Words are only turned back into strings here
+        words = list(self.vocab)
+        associations = {}
+        for ci, c in enumerate(characters_plus_text):
+            counts = self.associations[ci, :len(words)]
+            ids = np.flatnonzero(counts)
+            associations[c] = dict(zip([words[i] for i in ids.tolist()], counts[ids].tolist()))
+        frequencies = self.pooled_frequencies()
+        ids = np.flatnonzero(frequencies)
+        results = dict(sentiment=sentiment, story_lengths=self.story_lengths,
+            stories=self.story_ids, char_mentions=self.char_mentions,
+            char_stories=membership_table(self.char_stories),
+            associations=associations, char_pairs=self.char_pairs,
+            pair_stories=membership_table(self.pair_stories),
+            pooled_frequencies=dict(zip([words[i] for i in ids.tolist()], frequencies[ids].tolist())))
+        if self.max_words is not None:
+            results["association_errors"] = self.association_errors()
+        return results
+
+    def write_store(self, path):
+        """Write the aggregate to path as a sectioned store (see store.py)"""
+        arrays = {"story_lengths": np.array(self.story_lengths, dtype=np.int64),
+            "stories": np.array(self.story_ids, dtype=np.int64)}
+        for name in sentiment_series:
+            arrays["sentiment." + name + ".sum"] = self.sentiment_sum[name]
+            arrays["sentiment." + name + ".count"] = self.sentiment_count[name]
+        memberships = {}
+        for name, members in (("char_stories", self.char_stories), ("pair_stories", self.pair_stories)):
+            table = membership_table(members)
+            memberships[name] = table.pop("names")
+            for part, values in table.items():
+                arrays[name + "." + part] = np.array(values, dtype=np.int64)
+        # The words, utf-8 encoded and laid end to end
+        encoded = [w.encode() for w in self.vocab]
+        arrays["words"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        arrays["words.offsets"] = np.concatenate(([0], np.cumsum([len(w) for w in encoded], dtype=np.int64)))
+        # (character x word id) associations, in sparse rows
+        counts = self.associations[:, :len(encoded)]
+        chars, ids = np.nonzero(counts)
+        arrays["associations.indptr"] = np.concatenate(([0], np.cumsum(np.bincount(chars, minlength=len(counts)))))
+        arrays["associations.ids"] = ids.astype(np.int32)
+        arrays["associations.counts"] = counts[chars, ids]
+        arrays["pooled_frequencies"] = self.pooled_frequencies()
+        header = dict(characters=list(characters_plus_text), sentiment_series=list(sentiment_series),
+            memberships=memberships, char_mentions=self.char_mentions, char_pairs=self.char_pairs)
+        if self.max_words is not None:
+            header["association_errors"] = self.association_errors()
+        write_store(path, header, arrays)
+
+def tree_reduce(parts, max_words=None):
+    """Merge the aggregates in the iterable parts pairwise, as a balanced
+    tree whose shape only depends on the number of parts. Parts are
+    merged as they arrive, so only O(log n) of them are held at once.
+    """
+    # (number of parts merged, aggregate)
+    stack = []
+    for part in parts:
+        n = 1
+        while stack and stack[-1][0] == n:
+            n, part = 2*n, stack.pop()[1].merge(part)
+        stack.append((n, part))
+    if not stack:
+        return Aggregate(max_words)
+    _, result = stack.pop()
+    while stack:
+        result = stack.pop()[1].merge(result)
+    return result
+
+def aggregate_shard(task):
+    """Aggregate a shard, given as (list of (story_id, publication date, results
+    path), path of its saved aggregate or None, whether that is up to date,
+    max_words).
+    """
+    shard, part_path, up_to_date, max_words = task
+    agg = Aggregate(max_words)
+    if up_to_date:
+        agg.load(part_path)
+        return agg
+    for story_id, pub_date, path in shard:
+        agg.add_story(story_id, pub_date, *load_story(path))
+    if part_path:
+        agg.save(part_path)
+    return agg
+
+def aggregate(index, paths, num_workers=1, state_dir=None, max_words=None):
+    """Perform several analyses on the per-story results in paths, a dict
+    of story_id -> results path (see story_paths), using num_workers
+    processes, and return their Aggregate. index is the IndexTable of
+    the stories. If max_words is given, only about that many of the most
+    common words are counted for each character (see Aggregate).
+    If state_dir is given, the aggregate of each shard is saved there
+    along with a manifest of the files it was made from, and only the
+    shards with new, changed or removed stories are aggregated again
+    on the next run.
+    """
+    shards = []
+    for num, shard in shards_of(paths):
+        dates = index["date"][index.rows_of(shard)].tolist()
+        shards.append((num, [(story_id, pub_date, paths[story_id])
+            for story_id, pub_date in zip(shard, dates)]))
+
+    tasks = [(shard, None, False, max_words) for num, shard in shards]
+    if state_dir:
+        os.makedirs(state_dir, exist_ok=True)
+        manifest_path = os.path.join(state_dir, "manifest.json")
+        # Saved shards are only reusable if they were split and
+        # aggregated the same way
+        header = dict(version=4, shard_size=shard_size, characters=list(characters_plus_text),
+            max_words=max_words)
+        try:
+            manifest = json.loads(open(manifest_path, "r").read())
+        except (OSError, ValueError):
+            manifest = {}
+        old_shards = manifest.get("shards", {}) if manifest.get("header") == header else {}
+        new_shards = {}
+        tasks = []
+        for num, shard in shards:
+            new_shards[str(num)] = [[story_id, fingerprint(pub_date, path)]
+                for story_id, pub_date, path in shard]
+            part_path = os.path.join(state_dir, "shard-{}.json".format(num))
+            up_to_date = (old_shards.get(str(num)) == new_shards[str(num)]
+                and os.path.exists(part_path))
+            tasks.append((shard, part_path, up_to_date, max_words))
+        print('shards to aggregate: {} of {}'.format(
+            sum(not task[2] for task in tasks), len(tasks)))
+
+    def progress(parts):
+        done = 0
+        for (shard, *_), part in zip(tasks, parts):
+            if -done % 10000 < len(shard):
+                print('story:', done)
+            done += len(shard)
+            yield part
+
+    if num_workers == 1:
+        result = tree_reduce(progress(map(aggregate_shard, tasks)), max_words)
+    else:
+        with multiprocessing.Pool(num_workers) as pool:
+            result = tree_reduce(progress(pool.imap(aggregate_shard, tasks)), max_words)
 
+    if state_dir:
+        write_atomic(manifest_path, json.dumps(dict(header=header, shards=new_shards)))
+        # Forget the shards whose stories are all gone
+        for num in old_shards.keys() - new_shards.keys():
+            try:
+                os.remove(os.path.join(state_dir, "shard-{}.json".format(num)))
+            except OSError:
+                pass
+    return result
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: {} <index> <source dir> <output json file>".format(sys.argv[0]))
+    args = sys.argv[1:]
+    max_words = None
+    json_output = False
+    while args[:1] in (["--max-words"], ["--json"]):
+        if args[0] == "--json":
+            json_output = True
+            args = args[1:]
+        elif len(args) >= 2:
+            max_words = int(args[1])
+            args = args[2:]
+        else:
+            break
+    if len(args) not in (3, 4, 5):
+        print("Usage: {} [--max-words <n>] [--json] <index table> <source dir> <output file> [<num workers> [<state dir>]]".format(sys.argv[0]))
+        print("--max-words: only count about the n most common words of each character")
+        print("--json: write a single JSON file instead of a sectioned store (see store.py)")
     else:
-        index_path, in_dir, out_path = sys.argv[1:]
-        index = json.loads(open(index_path, "r").read())
-        in_files = files_of_type(in_dir, ".sentiment.json")
-        out_dict = aggregate(index, in_files)
-        out_file = open(out_path, "w")
-        out_file.write(json.dumps(out_dict))
+        index_path, in_dir, out_path = args[:3]
+        num_workers = int(args[3]) if len(args) >= 4 else os.cpu_count()
+        state_dir = args[4] if len(args) == 5 else None
+        index = IndexTable(index_path)
+        agg = aggregate(index, story_paths(in_dir), num_workers, state_dir, max_words)
+        if max_words is not None:
+            for c, errors in agg.association_errors().items():
+                print("{}: counts at most {max_error} too high, untracked words seen at most "
+                    "{untracked_max} times, top {certain_top} words certain".format(c, **errors))
+        if json_output:
+            out_file = open(out_path, "w")
+            out_file.write(json.dumps(agg.results()))
+        else:
+            agg.write_store(out_path)
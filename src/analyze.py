@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Runs every per-story analysis over a text file in a single pass, so
+that the sentence tokenization and character attribution are shared
+between the sentiment and the word-association analyses.
+"""
+
+import json, sys
+
+from analyze_senti import add_senti, finish_senti, new_senti
+from analyze_words import add_words, finish_words, new_words
+from common import write_atomic
+from results import write_results
+from sentences import attribute, iter_sentences, story_sentences
+
+def analyze(f):
+    """Return (sentiment, word-association) dicts for the file f.
+    These are the same as analyze_senti(f) and analyze_words(f).
+    """
+    return analyze_sentences(iter_sentences(f))
+
+def analyze_sentences(sentences):
+    """Return (sentiment, word-association) dicts for the given sentences"""
+    sentiment = new_senti()
+    words = new_words()
+    for c_in_s, s in attribute(sentences):
+        add_senti(sentiment, c_in_s, s)
+        add_words(words, c_in_s, s)
+    return finish_senti(sentiment), finish_words(words)
+
+def analyze_story(in_path, *out_paths):
+    """Analyze the text file at in_path and write the results either to
+    a single .results file or, given two paths, to .sentiment.json and
+    .words.json files.
+    """
+    # This also saves the story's sentence index for later analyses
+    senti_dict, words_dict = analyze_sentences(story_sentences(in_path))
+    if len(out_paths) == 1:
+        write_results(out_paths[0], senti_dict, words_dict)
+    else:
+        senti_path, words_path = out_paths
+        write_atomic(senti_path, json.dumps(senti_dict))
+        write_atomic(words_path, json.dumps(words_dict))
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        in_path, out_path = sys.argv[1:]
+        analyze_story(in_path, out_path)
+    elif len(sys.argv) == 5 and sys.argv[1] == "--json":
+        in_path, senti_path, words_path = sys.argv[2:]
+        analyze_story(in_path, senti_path, words_path)
+    else:
+        print("Usage: {} <input txt file> <output results file>".format(sys.argv[0]))
+        print("   or: {} --json <input txt file> <output sentiment json> <output words json>".format(sys.argv[0]))
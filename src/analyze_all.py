@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Runs the per-story analyses over every story in a build directory.
+
+Unlike invoking analyze.py once per story, this keeps a pool of worker
+processes alive for the whole run, so NLTK, the Punkt model and VADER
+are only loaded once per worker rather than once per story.
+Stories whose results are newer than their text are skipped, so the
+run may be interrupted and resumed at any time, just like make.
+"""
+
+import glob, json, multiprocessing, os, sys
+from multiprocessing import util
+
+from common import files_of_type, write_atomic
+
+def outputs_of(in_path, json_output=False):
+    """Return the result paths for an .ansi.txt file"""
+    base = in_path[:-len(".ansi.txt")]
+    if json_output:
+        return base + ".sentiment.json", base + ".words.json"
+    return base + ".results",
+
+def is_up_to_date(in_path, out_paths):
+    """Same rule as make: every output exists and is no older than the input"""
+    try:
+        in_mtime = os.path.getmtime(in_path)
+        return all(os.path.getmtime(p) >= in_mtime for p in out_paths)
+    except OSError:
+        return False
+
+def worker_cache_path(score_cache_path, pid):
+    """Return where worker pid leaves its most used sentences"""
+    return "{}.worker-{}".format(score_cache_path, pid)
+
+def save_worker_scores(score_cache_path, n):
+    """Save this worker's n most used sentences, with their uses"""
+    write_atomic(worker_cache_path(score_cache_path, os.getpid()), json.dumps(score_cache.most_common(n)))
+
+def warm_up(score_cache_path, json_output, cache_entries):
+    """Pool initializer: pay the import and model loading costs once"""
+    global analyze_story, score_cache, output_json
+    from analyze import analyze_story
+    from analyze_senti import score_cache
+    from sentences import punkt_tokenizer
+    # The Punkt model the analyses use is only loaded on first use
+    punkt_tokenizer()
+    if score_cache_path and os.path.exists(score_cache_path):
+        score_cache.load(score_cache_path)
+    if score_cache_path:
+        # Run as the worker exits, once the pool is closed and has no
+        # more stories to give out
+        util.Finalize(None, save_worker_scores, args=(score_cache_path, cache_entries), exitpriority=10)
+    output_json = json_output
+
+def analyze_one(in_path):
+    """Analyze a single story, returning (in_path, error message or None,
+    score cache hits, score cache misses)
+    """
+    hits, misses = score_cache.hits, score_cache.misses
+    try:
+        analyze_story(in_path, *outputs_of(in_path, output_json))
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    else:
+        error = None
+    return in_path, error, score_cache.hits - hits, score_cache.misses - misses
+
+def analyze_all(build_dir, num_workers=None, score_cache_path=None, json_output=False, cache_entries=1<<16):
+    """Analyze every out-of-date story in build_dir. If score_cache_path
+    is given, the sentence scores saved there are reused and the most
+    common sentences of this run are saved back to it. Results are
+    written as .results files, or as JSON if json_output is set.
+    Returns the number of stories which failed.
+    """
+    num_workers = num_workers or os.cpu_count()
+    pending = [p for p in files_of_type(build_dir, ".ansi.txt")
+        if not is_up_to_date(p, outputs_of(p, json_output))]
+    print("{} stories to analyze".format(len(pending)))
+
+    if score_cache_path:
+        # Left behind by workers of an interrupted run
+        for path in glob.glob(worker_cache_path(glob.escape(score_cache_path), "*")):
+            os.remove(path)
+
+    failures = hits = misses = 0
+    with multiprocessing.Pool(num_workers, initializer=warm_up,
+            initargs=(score_cache_path, json_output, cache_entries)) as pool:
+        results = pool.imap_unordered(analyze_one, pending)
+        for done, (in_path, error, story_hits, story_misses) in enumerate(results, 1):
+            if error is not None:
+                print("Error analyzing {}: {}".format(in_path, error))
+                failures += 1
+            hits += story_hits
+            misses += story_misses
+            if done % 1000 == 0: print("story:", done)
+        # Let the workers exit on their own, saving their sentences,
+        # rather than be terminated
+        pool.close()
+        pool.join()
+
+    # Report how well the sentence score caches did
+    print("score cache: {} hits, {} misses ({:.1%} hit rate)".format(
+        hits, misses, hits/max(1, hits+misses)))
+
+    if score_cache_path:
+        # Pool the sentences across workers and keep the most used ones
+        uses = {}
+        for path in glob.glob(worker_cache_path(glob.escape(score_cache_path), "*")):
+            for s, compound, n in json.loads(open(path, "r").read()):
+                uses[s] = (compound, uses.get(s, (0, 0))[1] + n)
+            os.remove(path)
+        common = sorted(uses.items(), key=lambda e: e[1][1], reverse=True)[:cache_entries]
+        # Same format as ScoreCache.save
+        write_atomic(score_cache_path, json.dumps({s: compound for s, (compound, n) in common}))
+    return failures
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    json_output = "--json" in args
+    if json_output:
+        args.remove("--json")
+    if len(args) not in (1, 2, 3):
+        print("Usage: {} [--json] <build dir> [<num workers> [<sentence score cache>]]".format(sys.argv[0]))
+    else:
+        build_dir = args[0]
+        num_workers = int(args[1]) if len(args) >= 2 else None
+        score_cache_path = args[2] if len(args) == 3 else None
+        failures = analyze_all(build_dir, num_workers, score_cache_path, json_output)
+        sys.exit(1 if failures else 0)
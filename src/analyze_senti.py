@@ -3,10 +3,11 @@
 associations to a json file
 """
 
-import json, sys, warnings
-from nltk import tokenize
+import json, sys, time, warnings
+from collections import OrderedDict
 
-from common import attribute_sentence_to_char, characters_plus_text
+from common import characters_plus_text, write_atomic
+from sentences import attributed_sentences
 
 with warnings.catch_warnings():
     # The nltk.twitter library emits a completely irrelevant warning
@@ -14,44 +15,184 @@ with warnings.catch_warnings():
     warnings.simplefilter("ignore", UserWarning)
     from nltk.sentiment.vader import SentimentIntensityAnalyzer
 
+from vader_batch import BatchScorer
 
 sid = SentimentIntensityAnalyzer()
+batch_scorer = BatchScorer(sid)
+# Number of sentences scored together
+batch_size = 1024
 
-def analyze_senti(f):
-    """Return a dict of information about the file f"""
-    sentences = tokenize.sent_tokenize(f.read())
+class ScoreCache:
+    """Bounded LRU cache of VADER compound scores, keyed by sentence.
+    Short sentences such as "Yes." or "it nodded." repeat a lot once the
+    character names have been removed, so there's no need to score
+    them again. A table of the most common sentences may also be saved
+    to disk and preloaded in later runs; those entries are never evicted.
+    """
+    def __init__(self, maxsize=1<<16):
+        self.maxsize = maxsize
+        # sentence -> [compound, uses]
+        self.recent = OrderedDict()
+        self.preloaded = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, s):
+        """Return the cached compound score of s, or None"""
+        entry = self.preloaded.get(s)
+        if entry is None:
+            entry = self.recent.get(s)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.recent.move_to_end(s)
+        self.hits += 1
+        entry[1] += 1
+        return entry[0]
+
+    def put(self, s, compound):
+        self.recent[s] = [compound, 1]
+        if len(self.recent) > self.maxsize:
+            self.recent.popitem(last=False)
+
+    def most_common(self, n):
+        """Return up to n (sentence, compound, uses) tuples, most used first"""
+        entries = list(self.preloaded.items()) + list(self.recent.items())
+        entries.sort(key=lambda e: e[1][1], reverse=True)
+        return [(s, compound, uses) for s, (compound, uses) in entries[:n]]
+
+    def load(self, path):
+        """Preload the sentences saved by save()"""
+        for s, compound in json.loads(open(path, "r").read()).items():
+            self.preloaded[s] = [compound, 0]
+
+    def save(self, path, n=1<<16):
+        """Save the n most used sentences to path"""
+        entries = self.most_common(n)
+        write_atomic(path, json.dumps({s: compound for s, compound, uses in entries}))
+
+score_cache = ScoreCache()
+
+def compound_scores(sentences):
+    """Return the VADER compound score of each sentence"""
+    scores = {}
+    unscored = []
+    for s in sentences:
+        # VADER splits on whitespace, so runs of whitespace don't affect it
+        key = " ".join(s.split())
+        if key in scores:
+            # Repeated within this batch; as good as a cache hit
+            score_cache.hits += 1
+        else:
+            scores[key] = score_cache.get(key)
+            if scores[key] is None:
+                unscored.append(key)
+    for key, compound in zip(unscored, batch_scorer.compounds(unscored)):
+        scores[key] = compound
+        score_cache.put(key, compound)
+    return [scores[" ".join(s.split())] for s in sentences]
 
+# Sentences longer than this (in chars) are scored in clause-sized windows
+long_sentence = 2000
+window_size = 1000
+# Seconds of scoring a story may take before long sentences are only
+# scored by their first window
+story_budget = 120
+
+def split_clauses(s, size=window_size):
+    """Split s into windows of at most size chars, breaking after clause
+    punctuation where possible, or else between words.
+    """
+    windows = []
+    while len(s) > size:
+        cut = max(s.rfind(p, 0, size) for p in ",;:")
+        if cut <= 0:
+            cut = s.rfind(" ", 0, size)
+        if cut <= 0:
+            cut = size-1
+        windows.append(s[:cut+1])
+        s = s[cut+1:]
+    windows.append(s)
+    return windows
+
+def new_senti():
+    """Return an empty per-story sentiment accumulator"""
     sentiment = {}
     for c in characters_plus_text:
         sentiment[c] = {"raw": []}
+    # pending holds the sentences waiting to be scored as one batch, and
+    # elapsed the time spent scoring the story's batches so far
+    return dict(sentiment=sentiment, pending=[], elapsed=0, over_budget=False)
 
-    for s in sentences:
-        if len(s) > 5000:
-            # VADER seems to hang on exceptionally long sentences.
-            # 5000 characters seems excessive for a single sentence,
-            # and no doubt, it is. Thank "The Longest Trollfic Ever",
-            # by "Troll": https://www.fimfiction.net/story/30328/the-longest-trollfic-ever
-            print("Warning: sentence is > 5000 chars. Skipping: %s [...]" %s[:400])
-            continue
+def add_senti(senti, c_in_s, s):
+    """Add a single sentence to the accumulator. c_in_s and s are
+    as returned by attribute_sentence_to_char.
+    """
+    senti["pending"].append((c_in_s, s))
+    if len(senti["pending"]) >= batch_size:
+        score_pending(senti)
 
-        # Attribute the sentiment to a single character, if applicable
-        # and remove all names
-        c_in_s, s = attribute_sentence_to_char(s)
+def sentence_windows(senti, s):
+    """Return the parts of s which are scored.
+    VADER's cost grows faster than linearly with the length of a
+    sentence, and it would seem to hang on the exceptionally long ones.
+    Thank "The Longest Trollfic Ever", by "Troll":
+    https://www.fimfiction.net/story/30328/the-longest-trollfic-ever
+    These are scored in windows instead, or by their first window alone
+    once the story is over its time budget, so that no sentence costs
+    more than its length's worth of windows, or one window.
+    """
+    if len(s) <= long_sentence:
+        return [s]
+    if senti["over_budget"]:
+        return split_clauses(s[:window_size+1])[:1]
+    return split_clauses(s)
+
+def score_pending(senti):
+    """Score the pending sentences and record their sentiment"""
+    start = time.time()
+    sentiment = senti["sentiment"]
+    pending = [(c_in_s, sentence_windows(senti, s)) for c_in_s, s in senti["pending"]]
+    compounds = iter(compound_scores([w for c_in_s, windows in pending for w in windows]))
+    for c_in_s, windows in pending:
+        if len(windows) == 1:
+            compound = next(compounds)
+        else:
+            # Combine the windows, weighted by their length
+            compound = sum(len(w)*next(compounds) for w in windows)/sum(len(w) for w in windows)
 
-        compound = sid.polarity_scores(s)["compound"]
         # Track sentiment of the overall text
         sentiment["text"]["raw"].append(compound)
 
+        # Attribute the sentiment to a single character, if applicable
         if len(c_in_s) == 1:
             c, = c_in_s
             sentiment[c]["raw"].append(compound)
+    senti["pending"] = []
+
+    senti["elapsed"] += time.time() - start
+    if senti["elapsed"] > story_budget and not senti["over_budget"]:
+        print("Warning: story is over its time budget of %d s. Scoring only the first %d chars of sentences over %d chars from now on" %(story_budget, window_size, long_sentence))
+        senti["over_budget"] = True
 
+def finish_senti(senti):
+    """Compute the averages and return the per-story sentiment dict"""
+    score_pending(senti)
+    sentiment = senti["sentiment"]
     # Compute average sentiments per character and entire text
     for p in sentiment.values():
         p["avg"] = sum(p["raw"])/len(p["raw"]) if p["raw"] else 0
 
     return dict(sentiment=sentiment)
 
+def analyze_senti(f):
+    """Return a dict of information about the file f"""
+    sentiment = new_senti()
+    # Attribute each sentence to its characters and remove all names
+    for c_in_s, s in attributed_sentences(f):
+        add_senti(sentiment, c_in_s, s)
+    return finish_senti(sentiment)
+
 if __name__ == "__main__":
     if len(sys.argv) != 3:
         print("Usage: {} <input txt file> <output json file>".format(sys.argv[0]))
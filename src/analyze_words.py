@@ -2,15 +2,129 @@
 """Analyzes the words associated with each character
 """
 
-import json, sys
+import json, re, string, sys, time, warnings
+from collections import Counter
 from nltk import tokenize
+from nltk.tokenize.punkt import PunktLanguageVars
 
-from common import attribute_sentence_to_char, characters_plus_text
+from common import characters_plus_text
+from sentences import attributed_sentences, punkt_tokenizer
 
-def analyze_words(f):
-    """Returns a dict of word-association information extracted from
-    the file f.
+class _KeepWordChars(dict):
+    """Translate table which deletes every char but a-z, - and ', and
+    turns ` back into '
+    """
+    def __missing__(self, c):
+        ch = chr(c)
+        self[c] = "'" if ch == "`" else ch if ch in "abcdefghijklmnopqrstuvwxyz-'" else None
+        return self[c]
+
+keep_word_chars = _KeepWordChars()
+
+def normalize(tokens):
+    """Return the words of the tokens of a sentence which went through
+    the contraction hack (see words_of), with extra punctuation removed
+    """
+    words = []
+    for w in tokens:
+        # Undo the contraction hack and remove extra punctuation
+        w = w.translate(keep_word_chars).strip("'").strip("-").strip("'")
+        if w: words.append(w)
+    return words
+
+# Sentences exercising the rules of word_tokenize which matter to
+# the words we count. The tokens of FastWordTokenizer are compared to
+# those of word_tokenize on these when it is created.
+probe_sentences = [
+    "",
+    "Hello, world!",
+    "it said: \"don't go,\" and didn't; it's 1,000 or 1:30 a,b a:b",
+    "what?! (yes) [no] {x} <y> a--b a---b a...b a.b. ##tag @me 50% & co",
+    "``Hi'' it''s 'tis 'twas o'clock rock'n'roll y'all ''quoted''",
+    "a*b a/b a+b a=b a_b a~b a^b a|b a\\b a`b a``b",
+    "I cannot, gimme, gonna, gotta, lemme, wanna! wanna go, wannabe more'n d'ye",
+    "Cannot. CANNOT cannot-do re-gonna 2cannot x_gonna canNOT",
+    "I wanna. I wanna.\" Wanna.) Wanna.? Gotta.. gonna!",
+    "It was... well... fine. Mr. Smith's dog. U.S.A. e.g. end.",
+    "\u00abQuoted\u00bb \u201cfancy\u201d \u2018single\u2019 en\u2013dash em\u2014dash",
+]
+
+class FastWordTokenizer:
+    """Splits sentences into the same tokens as word_tokenize, as far as
+    the words we count are concerned, with a couple of regexes instead of
+    the 30 or so word_tokenize applies. Which chars separate tokens
+    differs between nltk versions, so it is worked out from word_tokenize
+    itself.
     """
+    # Words which word_tokenize splits in two (text is lower-cased)
+    contractions = {"cannot": " can not ", "gimme": " gim me ", "gonna": " gon na ",
+        "gotta": " got ta ", "lemme": " lem me ", "wanna": " wan na "}
+    contraction = re.compile(r"(?=[cglw])(?:\b(?:cannot|gimme|gonna|gotta|lemme)\b|\bwanna(?=\s))")
+    # The period ending a sentence, which may be followed by closing chars
+    closing = " \t\n\r\f\v])}>\""
+    final_period = r"(?<=[^.])\.(?=[\])}>\"]*\s*$)"
+
+    def __init__(self):
+        self.punkt = punkt_tokenizer()
+        # Where Punkt might end a sentence (its English model uses the
+        # default language variables)
+        self.period_context = PunktLanguageVars().period_context_re()
+
+        # ' never gets here (see words_of)
+        candidates = string.punctuation.replace("'", "") + "\u00ab\u00bb\u201c\u201d\u2018\u2019\u201e\u2012\u2013\u2014\u2015"
+        single = ""
+        separators = []
+        # First chars of the separators
+        first = "."
+        for c in candidates:
+            if len(self._reference("a{}b".format(c))) > 1:
+                if len(self._reference("a{}1b".format(c))) == 1:
+                    # "," and ":" don't split numbers
+                    separators.append(re.escape(c) + r"(?!\d)")
+                else:
+                    single += re.escape(c)
+            elif len(self._reference("a{0}{0}b".format(c))) > 1:
+                # Only a run of them does ("--", "...")
+                separators.append(re.escape(c) + "{2,}")
+            else:
+                continue
+            first += re.escape(c)
+        separators = ["[{}]+".format(single)] + separators + [self.final_period]
+        # The lookahead makes re skip most chars without trying every branch
+        self.separators = re.compile("(?=[{}])(?:{})".format(first, "|".join(separators)))
+
+        self.exact = True
+        for s in probe_sentences:
+            s = s.lower().replace("'", "`")
+            if normalize(self.tokenize(s)) != self._reference(s):
+                warnings.warn("FastWordTokenizer does not match this version of nltk; "
+                    "falling back to word_tokenize")
+                self.exact = False
+                return
+
+    def _reference(self, s):
+        return normalize(tokenize.word_tokenize(s))
+
+    def _tokenize_line(self, s):
+        s = self.separators.sub(" ", s)
+        s = self.contraction.sub(lambda m: self.contractions[m.group()], " " + s + " ")
+        return s.split()
+
+    def tokenize(self, s):
+        """Return the tokens of the sentence s"""
+        if not self.exact:
+            return tokenize.word_tokenize(s)
+        # word_tokenize splits s into sentences first, and s (now
+        # lower-cased) may well look like several to Punkt. Splitting off
+        # closing quotes and brackets makes no difference though.
+        if self.period_context.search(s, 0, len(s.rstrip(self.closing))):
+            return [t for line in self.punkt.tokenize(s) for t in self._tokenize_line(line)]
+        return self._tokenize_line(s)
+
+word_tokenizer = FastWordTokenizer()
+
+def new_words():
+    """Return an empty per-story word-association accumulator"""
     # associations is structured as:
     # { "char_name":
     #   { "word": 123,
@@ -26,39 +140,94 @@ def analyze_words(f):
     # sorted alphabetically and joined with a comma
     char_pairs = {}
     for c in characters_plus_text:
-        associations[c] = {}
-
-    sentences = tokenize.sent_tokenize(f.read())
-    for s_ in sentences:
-        c_in_s, s = attribute_sentence_to_char(s_)
-        pair_name = ",".join(sorted(c_in_s))
-
-        # Increment the number of times this pair has been seen
-        char_pairs[pair_name] = char_pairs.get(pair_name, 0) + 1
-
-        # Parser will default to splitting words on apostrophe - fight that.
-        # Note: it also turns end-quotes (") into "''" and start-quotes (") into "``"
-        # We don't care about that - only the actual words
-        words = tokenize.word_tokenize(s.lower().replace("'", '`'))
-        words_fixed = []
-        for w in words:
-            # Undo the contraction hack
+        associations[c] = Counter()
+    return dict(associations=associations, char_pairs=char_pairs)
+
+def add_words(words, c_in_s, s):
+    """Count the words of a single sentence into the accumulator.
+    c_in_s and s are as returned by attribute_sentence_to_char.
+    """
+    associations, char_pairs = words["associations"], words["char_pairs"]
+    pair_name = ",".join(sorted(c_in_s))
+
+    # Increment the number of times this pair has been seen
+    char_pairs[pair_name] = char_pairs.get(pair_name, 0) + 1
+
+    words_fixed = words_of(s)
+    for c in tuple(c_in_s) + ("text",):
+        # Increment the number of times each word has been seen
+        associations[c].update(words_fixed)
+
+def words_of(s):
+    """Return the words of the sentence s, lower-cased and stripped of
+    punctuation
+    """
+    # Parser will default to splitting words on apostrophe - fight that.
+    # Note: it also turns end-quotes (") into "''" and start-quotes (") into "``"
+    # We don't care about that - only the actual words
+    return normalize(word_tokenizer.tokenize(s.lower().replace("'", '`')))
+
+def finish_words(words):
+    """Return the per-story word-association dict"""
+    return words
+
+def analyze_words(f):
+    """Returns a dict of word-association information extracted from
+    the file f.
+    """
+    words = new_words()
+    for c_in_s, s in attributed_sentences(f):
+        add_words(words, c_in_s, s)
+    return finish_words(words)
+
+def profile(sentences):
+    """Count the words of the (characters, sentence) pairs in sentences
+    both the way add_words does and the original way (word_tokenize,
+    filtering every char and one dict update per word), timing each stage.
+    Returns ({stage: seconds}, whether the counts are the same).
+    """
+    times = dict.fromkeys(("tokenize", "normalize", "count", "word_tokenize",
+        "normalize (orig)", "count (orig)"), 0.0)
+    fast = {c: Counter() for c in characters_plus_text}
+    orig = {c: {} for c in characters_plus_text}
+    for c_in_s, s in sentences:
+        chars = tuple(c_in_s) + ("text",)
+        t0 = time.perf_counter()
+        tokens = word_tokenizer.tokenize(s.lower().replace("'", '`'))
+        t1 = time.perf_counter()
+        words = normalize(tokens)
+        t2 = time.perf_counter()
+        for c in chars:
+            fast[c].update(words)
+        t3 = time.perf_counter()
+        tokens = tokenize.word_tokenize(s.lower().replace("'", '`'))
+        t4 = time.perf_counter()
+        words = []
+        for w in tokens:
             w = w.replace("`", "'")
-            # Remove extra punctuation
             w = "".join(l for l in w if l in "abcdefghijklmnopqrstuvwxyz-'")
             w = w.strip("'").strip("-").strip("'")
-            if w: words_fixed.append(w)
-        
-        for c in tuple(c_in_s) + ("text",):
-            for word in words_fixed:
-                # Increment the number of times this word has been seen
-                associations[c][word] = associations[c].get(word, 0) + 1
-            
-    return dict(associations=associations, char_pairs=char_pairs)
+            if w: words.append(w)
+        t5 = time.perf_counter()
+        for c in chars:
+            for word in words:
+                orig[c][word] = orig[c].get(word, 0) + 1
+        t6 = time.perf_counter()
+        for stage, t in zip(times, (t1-t0, t2-t1, t3-t2, t4-t3, t5-t4, t6-t5)):
+            times[stage] += t
+    same = all(list(fast[c].items()) == list(orig[c].items()) for c in characters_plus_text)
+    return times, same
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
+    if len(sys.argv) == 3 and sys.argv[1] == "--profile":
+        times, same = profile(attributed_sentences(open(sys.argv[2])))
+        for stage, t in times.items():
+            print("{:>18}: {:.3f}s".format(stage, t))
+        print("fast: {:.3f}s, original: {:.3f}s, same counts: {}".format(
+            sum(list(times.values())[:3]), sum(list(times.values())[3:]), same))
+    elif len(sys.argv) != 3:
         print("Usage: {} <input txt file> <output json file>".format(sys.argv[0]))
+        print("   or: {} --profile <input txt file>".format(sys.argv[0]))
     else:
         in_path, out_path = sys.argv[1:]
         in_file = open(in_path)
@@ -2,6 +2,8 @@
 aggregation (etc) stages.
 """
 
+import os, re
+
 # There is some bias here based on which characters I consider important
 # enough to track. My intention is mainly to analyze the main 6, though
 # and beyond that most of this data is probably not going to be used
@@ -54,23 +56,73 @@ class story_length:
     med = 1000
 
 
+# Compiled name matchers, keyed by id() of the roster they were built from
+_matchers = {}
+
+def _compile_matcher(chars):
+    """Build a single regex that matches every nickname of every
+    character in chars, plus a map of nickname -> (character, priority).
+    Within a character, nicknames are tried in the order they are listed
+    so that e.g. "Rainbow Dash" wins over "Rainbow".
+    """
+    owners = {}
+    for c, nicks in chars.items():
+        for priority, nick in enumerate(nicks):
+            owners.setdefault(nick, (c, priority))
+    if not owners:
+        return None, owners
+    pattern = re.compile("|".join(re.escape(nick) for nick in owners))
+    return pattern, owners
+
 def attribute_sentence_to_char(sentence, chars=characters_plus_text, replace=True):
     """Search for any occurrences of the characters' names
     or nicknames inside the sentence, remove them, and then return the
     names of the characters found and a sentence with their names removed.
+    chars maps each character to its nicknames, highest priority first;
+    only the highest-priority nickname found is replaced.
     """
+    # Only compile each roster once
+    cached = _matchers.get(id(chars))
+    if cached is None or cached[0] is not chars:
+        cached = (chars,) + _compile_matcher(chars)
+        _matchers[id(chars)] = cached
+    _, pattern, owners = cached
+    if pattern is None:
+        return {}.keys(), sentence
 
+    # For each character found, the highest-priority nickname used
+    matches = pattern.findall(sentence)
+    if not matches:
+        return {}.keys(), sentence
     c_in_s = {}
-    for c, nicks in characters_plus_text.items():
-        for nick in nicks:
-            if nick in sentence:
-                c_in_s[c] = nick
-                break
+    for nick in matches:
+        c, priority = owners[nick]
+        if c not in c_in_s or priority < owners[c_in_s[c]][1]:
+            c_in_s[c] = nick
 
     # Replace all character names with a neutral word
-    # sum() is used to flatten the dict items
     if replace:
-        for nick in c_in_s.values():
-            sentence = sentence.replace(nick, "it")
+        chosen = set(c_in_s.values())
+        if chosen.issuperset(matches):
+            sentence = pattern.sub("it", sentence)
+        else:
+            # Lower-priority nicknames are left in place
+            sentence = pattern.sub(lambda m: "it" if m.group() in chosen else m.group(), sentence)
 
     return c_in_s.keys(), sentence
+
+def files_of_type(srcdir, ext):
+    for root, dirs, files in os.walk(srcdir):
+        for f in files:
+            if f.endswith(ext):
+                yield os.path.join(root, f)
+
+def write_atomic(path, data):
+    """Write data (text, or bytes in binary mode) to path such that an
+    interrupted write never leaves a partial file behind (which would
+    otherwise look up-to-date).
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb" if isinstance(data, bytes) else "w") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""Extracts the text of .epub books, as ASCII.
+
+This does the job of `ebook-convert` followed by `unidecode` in one
+step and one process: the epub (a zip file) is read directly, its XHTML
+chapters are converted to text in the order of its spine, paragraphs
+being separated by blank lines and line breaks (<br/>) by a newline, as
+ebook-convert does, and unidecode is applied in memory, so
+only the .ansi.txt file is written. Use --all to extract a whole
+directory of epubs with a pool of workers, and --check to compare the
+text of a sample of epubs with what ebook-convert made of them.
+"""
+
+import codecs, difflib, multiprocessing, os, posixpath, random, re, sys, zipfile
+from html.parser import HTMLParser
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+from unidecode import unidecode
+
+from common import files_of_type, write_atomic
+
+# Elements which start a new paragraph
+block_tags = {"address", "article", "aside", "blockquote", "dd", "div", "dl",
+    "dt", "figcaption", "figure", "footer", "h1", "h2", "h3", "h4", "h5", "h6",
+    "header", "hr", "li", "ol", "p", "pre", "section", "table", "td", "th", "tr", "ul"}
+# Elements whose contents aren't text
+hidden_tags = {"head", "script", "style", "title"}
+
+# The encoding declared by an XML declaration or a <meta> tag
+encoding_declaration = re.compile(rb"""<\?xml[^>]*encoding\s*=\s*["']([\w.:-]+)|<meta[^>]*charset\s*=\s*["']?([\w.:-]+)""", re.I)
+
+class TextExtractor(HTMLParser):
+    """Collects the paragraphs of text of an XHTML document"""
+    def __init__(self):
+        super().__init__()
+        self.paragraphs = []
+        # Lines of the current paragraph, and text of its current line
+        self.lines = []
+        self.chunks = []
+        self.hidden = 0
+
+    def end_line(self):
+        line = " ".join("".join(self.chunks).split())
+        if line:
+            self.lines.append(line)
+        self.chunks = []
+
+    def end_paragraph(self):
+        self.end_line()
+        if self.lines:
+            self.paragraphs.append("\n".join(self.lines))
+        self.lines = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in hidden_tags:
+            self.hidden += 1
+        elif tag in block_tags:
+            self.end_paragraph()
+        elif tag == "br":
+            self.end_line()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in block_tags:
+            self.end_paragraph()
+        elif tag == "br":
+            self.end_line()
+
+    def handle_endtag(self, tag):
+        if tag in hidden_tags:
+            self.hidden = max(0, self.hidden - 1)
+        elif tag in block_tags:
+            self.end_paragraph()
+
+    def handle_data(self, data):
+        if not self.hidden:
+            self.chunks.append(data)
+
+def decode_document(data):
+    """Return the XHTML document data (bytes) as text, decoded with the
+    encoding given by its byte order mark or declaration, if any, and
+    utf-8 otherwise.
+    """
+    for bom, encoding in ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"),
+            (codecs.BOM_UTF16_BE, "utf-16")):
+        if data.startswith(bom):
+            return data.decode(encoding, "replace")
+    encoding = "utf-8"
+    declared = encoding_declaration.search(data, 0, 1024)
+    if declared:
+        name = (declared.group(1) or declared.group(2)).decode("ascii")
+        try:
+            encoding = codecs.lookup(name).name
+        except LookupError:
+            pass
+    return data.decode(encoding, "replace")
+
+def html_paragraphs(html):
+    """Return the paragraphs of text of the XHTML document html"""
+    parser = TextExtractor()
+    parser.feed(html)
+    parser.close()
+    parser.end_paragraph()
+    return parser.paragraphs
+
+def spine(book):
+    """Return the paths, in reading order, of the documents of the epub
+    book (an open zipfile.ZipFile).
+    """
+    container = ElementTree.fromstring(book.read("META-INF/container.xml"))
+    rootfile = container.find(".//{*}rootfile")
+    opf_path = rootfile.get("full-path") if rootfile is not None else None
+    if not opf_path:
+        raise ValueError("container.xml has no rootfile")
+    opf = ElementTree.fromstring(book.read(opf_path))
+    base = posixpath.dirname(opf_path)
+    manifest = {item.get("id"): item.get("href") for item in opf.findall(".//{*}item")}
+    return [posixpath.normpath(posixpath.join(base, unquote(manifest[ref.get("idref")])))
+        for ref in opf.findall(".//{*}itemref") if ref.get("idref") in manifest]
+
+def epub_text(epub_path):
+    """Return the text of the epub at epub_path (unicode)"""
+    paragraphs = []
+    with zipfile.ZipFile(epub_path) as book:
+        for path in spine(book):
+            html = decode_document(book.read(path))
+            paragraphs.extend(html_paragraphs(html))
+    return "\n\n".join(paragraphs) + "\n"
+
+def extract(epub_path, out_path):
+    """Write the ASCII text of the epub at epub_path to out_path"""
+    write_atomic(out_path, unidecode(epub_text(epub_path)))
+
+def ansi_path(epub_path, epub_dir, out_dir):
+    """Return where the text of epub_path (within epub_dir) goes, as in
+    the Makefile
+    """
+    rel = os.path.relpath(epub_path, epub_dir)
+    return os.path.join(out_dir, rel[:-len(".epub")] + ".ansi.txt")
+
+def extract_task(paths):
+    epub_path, out_path = paths
+    try:
+        extract(epub_path, out_path)
+    except Exception as e:
+        # A malformed book mustn't stop the others from being extracted
+        return "{}: {}: {}".format(epub_path, type(e).__name__, e)
+    return None
+
+def extract_all(epub_dir, out_dir, num_workers):
+    """Extract every epub of epub_dir which is newer than its text into
+    out_dir, using num_workers processes.
+    """
+    tasks = []
+    for epub_path in sorted(files_of_type(epub_dir, ".epub")):
+        out_path = ansi_path(epub_path, epub_dir, out_dir)
+        if not os.path.exists(out_path) or os.path.getmtime(out_path) < os.path.getmtime(epub_path):
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            tasks.append((epub_path, out_path))
+    print("books to extract:", len(tasks))
+    failures = 0
+    with multiprocessing.Pool(num_workers) as pool:
+        for done, error in enumerate(pool.imap_unordered(extract_task, tasks, chunksize=16), 1):
+            if error:
+                print(error)
+                failures += 1
+            if done % 10000 == 0:
+                print("book:", done)
+    return failures
+
+def parity(epub_path, reference_path):
+    """Return how similar (from 0 to 1) the words of the text of the epub
+    at epub_path are to those of reference_path, its ebook-convert output.
+    """
+    ours = unidecode(epub_text(epub_path)).split()
+    theirs = unidecode(open(reference_path, "r", errors="replace").read()).split()
+    return difflib.SequenceMatcher(None, ours, theirs, autojunk=False).ratio()
+
+def check(epub_dir, out_dir, sample_size):
+    """Compare the text of a random sample of the epubs which have been
+    converted by ebook-convert (to <out_dir>/<book>.txt) with ours.
+    """
+    pairs = [(p, ansi_path(p, epub_dir, out_dir).replace(".ansi.txt", ".txt"))
+        for p in files_of_type(epub_dir, ".epub")]
+    pairs = [pair for pair in pairs if os.path.exists(pair[1])]
+    sample = random.sample(pairs, min(sample_size, len(pairs)))
+    ratios = []
+    for epub_path, reference_path in sample:
+        ratios.append(parity(epub_path, reference_path))
+        print("{:.4f} {}".format(ratios[-1], epub_path))
+    if ratios:
+        print("{} books, mean similarity {:.4f}, lowest {:.4f}".format(
+            len(ratios), sum(ratios)/len(ratios), min(ratios)))
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) in (3, 4) and args[0] == "--all":
+        num_workers = int(args[3]) if len(args) == 4 else os.cpu_count()
+        failures = extract_all(args[1], args[2], num_workers)
+        sys.exit(1 if failures else 0)
+    elif len(args) in (3, 4) and args[0] == "--check":
+        check(args[1], args[2], int(args[3]) if len(args) == 4 else 20)
+    elif len(args) == 2:
+        extract(*args)
+    else:
+        print("Usage: {} <epub file> <output .ansi.txt file>".format(sys.argv[0]))
+        print("       {} --all <epub dir> <output dir> [<num workers>]".format(sys.argv[0]))
+        print("       {} --check <epub dir> <output dir> [<sample size>]".format(sys.argv[0]))
+        print("--all: extract every epub which is newer than its text")
+        print("--check: compare the text of a sample of epubs with their ebook-convert .txt")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Columnar table of the story metadata of index.json.
+
+index.json is several hundred MB of JSON, of which the analyses only use
+a few fields per story. This turns it once into a table (a store, see
+store.py) with one array per column, rows being in order of story id:
+
+    id, words, likes, dislikes, votes (likes + dislikes), rating,
+    title_length, date (average date_modified of the chapters),
+    status (index into the header's "statuses")
+
+and the titles, utf-8 encoded and laid end to end. Columns are memory-
+mapped and read on first use.
+"""
+
+import json, sys
+import numpy as np
+
+from store import read_array, write_store
+
+def story_rating(story_info):
+    """Return (L-D)/(L+D) where L=likes, D=dislikes"""
+    L, D = story_info.get("likes", 0), story_info.get("dislikes", 0)
+    return (L-D)/max(1, L+D)
+
+def average_date(story_info):
+    """Return the average date_modified of the chapters of the story, as
+    its sentiment data is unavailable on a per-chapter basis.
+    """
+    dates = [ch["date_modified"] for ch in story_info["chapters"]]
+    return sum(dates)/max(1, len(dates))
+
+def build_table(index, path):
+    """Write the table of the dict index (the contents of index.json) to path"""
+    ids = sorted(index, key=int)
+    stories = [index[story_id] for story_id in ids]
+    statuses = sorted({str(s.get("status")) for s in stories})
+    status_codes = {s: i for i, s in enumerate(statuses)}
+    # Some stories have no title
+    titles = [(s.get("title") or "").encode() for s in stories]
+    columns = dict(
+        id=np.array(ids, dtype=np.int64),
+        words=np.array([s.get("words", 0) for s in stories], dtype=np.int64),
+        likes=np.array([s.get("likes", 0) for s in stories], dtype=np.int64),
+        dislikes=np.array([s.get("dislikes", 0) for s in stories], dtype=np.int64),
+        rating=np.array([story_rating(s) for s in stories]),
+        title_length=np.array([len(s.get("title") or "") for s in stories], dtype=np.int64),
+        date=np.array([average_date(s) for s in stories]),
+        status=np.array([status_codes[str(s.get("status"))] for s in stories], dtype=np.int32),
+    )
+    columns["votes"] = columns["likes"] + columns["dislikes"]
+    columns["titles"] = np.frombuffer(b"".join(titles), dtype=np.uint8)
+    columns["titles.offsets"] = np.concatenate(([0], np.cumsum([len(t) for t in titles], dtype=np.int64)))
+    write_store(path, dict(statuses=statuses), columns)
+
+class IndexTable:
+    """The table at path"""
+    def __init__(self, path):
+        self.path = path
+        self.header = json.loads(open(path, "r").read())
+        self.statuses = self.header["statuses"]
+        self.columns = {}
+
+    def __len__(self):
+        return len(self["id"])
+
+    def __getitem__(self, name):
+        """Return the column name"""
+        if name not in self.columns:
+            self.columns[name] = read_array(self.path, name)
+        return self.columns[name]
+
+    def ids(self):
+        """Return the story ids, as in index.json"""
+        return [str(story_id) for story_id in self["id"].tolist()]
+
+    def titles(self):
+        """Return the title of every story"""
+        titles = memoryview(self["titles"])
+        offsets = self["titles.offsets"].tolist()
+        return [bytes(titles[a:b]).decode() for a, b in zip(offsets, offsets[1:])]
+
+    def rows_of(self, story_ids):
+        """Return the rows of story_ids, which must all be in the table"""
+        ids = self["id"]
+        story_ids = np.asarray(story_ids, dtype=np.int64)
+        rows = np.searchsorted(ids, story_ids)
+        found = rows < len(ids)
+        found[found] = ids[rows[found]] == story_ids[found]
+        if not found.all():
+            raise KeyError(str(story_ids[~found][0]))
+        return rows
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: {} <index.json> <output table>".format(sys.argv[0]))
+    else:
+        index_path, out_path = sys.argv[1:]
+        build_table(json.loads(open(index_path, "r").read()), out_path)
@@ -0,0 +1,72 @@
+"""Tables of which stories each character (or group of characters)
+appears in, and in how many sentences.
+
+aggregated.json lists every story once, in "stories", and refers to
+stories by their row in that list. A membership table stores, for each
+of its names, the rows of the stories it appears in and the matching
+counts, in compressed sparse (CSR) form:
+
+    {"names": [name, ...],
+     "indptr": [0, ...],  # name i's entries are indptr[i]:indptr[i+1]
+     "rows": [row, ...],  # sorted for each name
+     "counts": [count, ...]}
+"""
+
+import numpy as np
+
+def membership_table(members):
+    """Return the membership table of members, a dict of
+    name -> (list of rows, list of counts), rows being sorted.
+    """
+    lengths = [len(rows) for rows, counts in members.values()]
+    return dict(names=list(members),
+        indptr=[0] + np.cumsum(lengths, dtype=np.int64).tolist(),
+        rows=[r for rows, counts in members.values() for r in rows],
+        counts=[n for rows, counts in members.values() for n in counts])
+
+def table_members(table):
+    """Inverse of membership_table"""
+    indptr, rows, counts = table["indptr"], table["rows"], table["counts"]
+    return {name: (rows[indptr[i]:indptr[i+1]], counts[indptr[i]:indptr[i+1]])
+        for i, name in enumerate(table["names"])}
+
+class Membership:
+    """Queries on a membership table of aggregated.json, given the
+    aggregate's list of story ids.
+    """
+    def __init__(self, table, story_ids):
+        self.names = {name: i for i, name in enumerate(table["names"])}
+        self.indptr = np.asarray(table["indptr"], dtype=np.int64)
+        self.rows = np.asarray(table["rows"], dtype=np.int64)
+        self.counts = np.asarray(table["counts"], dtype=np.int64)
+        self.story_ids = np.asarray(story_ids)
+        # Story ids are numeric and stories are in order of id
+        self.story_nums = self.story_ids.astype(np.int64)
+
+    def rows_of(self, name):
+        """Return the rows of the stories in which name appears"""
+        i = self.names[name]
+        return self.rows[self.indptr[i]:self.indptr[i+1]]
+
+    def counts_of(self, name):
+        """Return the number of sentences name appears in, in each of
+        the stories of rows_of(name)
+        """
+        i = self.names[name]
+        return self.counts[self.indptr[i]:self.indptr[i+1]]
+
+    def rows_with_all(self, names):
+        """Return the rows of the stories in which all of names appear"""
+        rows = None
+        for name in names:
+            rows = self.rows_of(name) if rows is None else \
+                np.intersect1d(rows, self.rows_of(name), assume_unique=True)
+        return rows
+
+    def stories_of(self, *names):
+        """Return the ids of the stories in which all of names appear"""
+        return self.story_ids[self.rows_with_all(names)]
+
+    def row_of(self, story_ids):
+        """Return the rows of story_ids (which must be aggregated)"""
+        return np.searchsorted(self.story_nums, np.asarray(story_ids, dtype=np.int64))
@@ -0,0 +1,129 @@
+"""Tells words apart from non-words (typos, made-up words, ...) for
+plot.most_common_nonwords.
+
+Spell checking, and enchant's suggest() in particular, is slow, so every
+word classified is remembered in a cache file. The cache is only valid
+for the dictionary and the extra words it was made with, and is shared
+by every figure and run. Words missing from it are classified in
+batches by a pool of worker processes.
+"""
+
+import fcntl, json, multiprocessing, os
+from functools import partial
+import enchant
+
+from common import write_atomic
+
+# The spell checker of this process
+_dictionary = None
+
+# Where enchant's providers (hunspell, nuspell, aspell, ...) look for
+# their dictionaries, besides $DICPATH
+dictionary_dirs = ["~/.config/enchant/hunspell", "~/.config/enchant/nuspell",
+    "/usr/share/hunspell", "/usr/share/myspell", "/usr/share/myspell/dicts",
+    "/usr/local/share/hunspell", "/usr/share/aspell", "/usr/lib/aspell",
+    "/usr/lib/aspell-0.60", "/usr/lib64/aspell-0.60"]
+
+def dictionary():
+    """Return the en_US enchant dictionary"""
+    global _dictionary
+    if _dictionary is None:
+        _dictionary = enchant.Dict("en_US")
+    return _dictionary
+
+def _forget_dictionary():
+    # Don't share the parent's enchant handle with a forked worker
+    global _dictionary
+    _dictionary = None
+
+def dictionary_files(d):
+    """Return [path, size, mtime] of every file which may hold the words
+    of the enchant dictionary d, i.e. those of its language, to tell
+    whether the dictionary changed.
+    """
+    language = d.tag.split("_")[0]
+    dirs = os.environ.get("DICPATH", "").split(os.pathsep) + dictionary_dirs
+    files = []
+    for directory in dict.fromkeys(os.path.expanduser(p) for p in dirs if p):
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            path = os.path.join(directory, name)
+            if name.startswith(language) and os.path.isfile(path):
+                st = os.stat(path)
+                files.append([path, st.st_size, st.st_mtime_ns])
+    return sorted(files)
+
+def is_nonword(w, extra_words):
+    """Return whether w is neither an English word nor in extra_words"""
+    if w == "": return False
+    d = dictionary()
+    is_nw = w not in extra_words and not d.check(w) \
+      and not any(similar.lower().replace("-","")==w for similar in d.suggest(w))
+    if w.endswith("'s"):
+        is_nw = is_nw and is_nonword(w[:-2], extra_words)
+    if "-" in w:
+        is_nw = is_nw and any(is_nonword(k, extra_words) for k in w.split("-"))
+    return is_nw
+
+class NonwordCache:
+    """is_nonword for many words, remembered in the file at path (if any)"""
+    def __init__(self, path, extra_words, num_workers=None):
+        self.path = path
+        self.extra_words = extra_words
+        self.num_workers = num_workers or os.cpu_count()
+        d = dictionary()
+        # Verdicts depend on the dictionary's data, not on the version
+        # of the enchant bindings
+        self.header = dict(version=2, tag=d.tag, provider=d.provider.name,
+            provider_file=d.provider.file, dictionary_files=dictionary_files(d),
+            extra_words=sorted(extra_words))
+        self.nonword = self._load()
+
+    def _load(self):
+        """Return the words classified in the cache file"""
+        try:
+            saved = json.loads(open(self.path, "r").read())
+        except (OSError, TypeError, ValueError):
+            return {}
+        return saved["words"] if saved.get("header") == self.header else {}
+
+    def save(self):
+        if not self.path:
+            return
+        with open(self.path + ".lock", "w") as lock:
+            # Other processes may be classifying words at the same time
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            words = self._load()
+            words.update(self.nonword)
+            write_atomic(self.path, json.dumps(dict(header=self.header, words=words)))
+
+    def classify(self, words):
+        """Return {word: is_nonword(word)} for the list of words"""
+        new = [w for w in dict.fromkeys(words) if w not in self.nonword]
+        if new:
+            classify = partial(is_nonword, extra_words=self.extra_words)
+            # The workers of plot.py --all can't start a pool of their own
+            if self.num_workers > 1 and len(new) > 1 and not multiprocessing.current_process().daemon:
+                with multiprocessing.Pool(min(self.num_workers, len(new)), _forget_dictionary) as pool:
+                    results = pool.map(classify, new)
+            else:
+                results = [classify(w) for w in new]
+            self.nonword.update(zip(new, results))
+            self.save()
+        return {w: self.nonword[w] for w in words}
+
+    def first_nonwords(self, ranked, count, batch_size=256):
+        """Return the first count non-words of the list ranked, only
+        classifying the words up to the batch in which they are found.
+        """
+        found = []
+        for start in range(0, len(ranked), batch_size):
+            batch = ranked[start:start+batch_size]
+            nonword = self.classify(batch)
+            found.extend(w for w in batch if nonword[w])
+            if len(found) >= count:
+                break
+        return found[:count]
@@ -2,13 +2,20 @@
 """Plots the various aggregated data
 """
 
-import datetime, inspect, json, os.path, random, sys
-from math import ceil, cos, floor, pi, tan
+import datetime, heapq, inspect, multiprocessing, os.path, random, sys
+from collections.abc import Mapping
+from math import ceil, floor
 import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.colors import LogNorm
 from matplotlib.font_manager import FontProperties
-import enchant
 
 from common import characters, main6, story_length
+from index_table import IndexTable
+from membership import Membership
+from nonwords import NonwordCache
+from smoothing import lowpass, sliding_means
+from store import open_aggregate
 
 # Based on http://helmet.kafuka.org/ponycolors/
 colors = {
@@ -57,62 +64,24 @@ fim_words = set([
     "somepony",
 ])
 
+# Where the spell checks of most_common_nonwords are kept (see nonwords.py)
+nonword_cache_path = None
+nonwords = None
+
 legendFont = FontProperties()
 legendFont.set_size('small')
 
-cot = lambda x: 1/tan(x)
 mean = lambda x: sum(x)/len(x)
 floorto = lambda x, ival: floor(x/ival)*ival
 ceilto = lambda x, ival: ceil(x/ival)*ival
 
-def story_rating(story_info, thresh=1):
-    """Return (valid, rating) where valid indicates if the story has
-    enough likes/dislikes for the rating to be valid, rating is
-    (L-D)/(L+D), where L=likes, D=dislikes
-    """
-    L, D = story_info["likes"], story_info["dislikes"]
-    valid = L+D >= thresh
-    rating = (L-D)/max(1, L+D)
-    return valid, rating
+# Number of (x, y) bins of the density plots
+density_bins = (128, 64)
 
-def smooth(month_data=None, percent_data=None):
-    """Smooth month-based data so that the long-term trends are more visible
-    """
-    # Work based on http://www.claysturner.com/dsp/Butterworth%20Filter%20Formulae.pdf
-    # data is sampled by months, want trends > 6 months to be visible
-    # Use fc =~ 1/6
-    if month_data is not None:
-        fc = 1/12
-    if percent_data is not None:
-        fc = 1/25
-    c = cot(pi*fc)
-    # Second order LPF butterworth:
-    alpha = 2*cos(pi/4)
-    # Coefficients (listed at the very bottom of the PDF)
-    DC = 1/(1+c*(c+alpha))
-    # x and y coefficients for filtering
-    xk = [1, 2, 1]
-    yk = [1, 2*(1-c*c)/(1+c*(c+alpha)), (1+c*(c-alpha))/(1+c*(c+alpha))]
-    # Our filter is:
-    # yk[0] y[n-0] + yk[1] y[n-1] + ... = DC(xk[0]x[n-0] + xk[1]x[n-1] + ... )
-    def filt(x, y, n):
-        # Follow the equation further up to solve for y[n-0]
-        # When indexing x[n-k], y[n-k] for n-k < 0, we assume a
-        # steady-state value for n-k <= 0
-        if n == 0:
-            return x[0]
-
-        rhs = DC*sum(x[max(0, n-k)] * xk[k] for k in range(3))
-        other_y = sum(y[max(0, n-k)] * yk[k] for k in range(1, 3))
-        this_y = (rhs - other_y) / yk[0]
-        return this_y
-
-    x = month_data or percent_data
-    y = []
-    for n in range(len(x)):
-        y.append(filt(x, y, n))
-
-    return y
+# Cutoff frequencies of the smoothing (see smoothing.py) of the data
+# sampled by months, and by percent through a story
+month_fc = 1/12
+percent_fc = 1/25
 
 
 def char_senti_by_month(agg, chars=main6, do_smooth=False, ylim=(0.00, 0.13)):
@@ -128,7 +97,7 @@ def char_senti_by_month(agg, chars=main6, do_smooth=False, ylim=(0.00, 0.13)):
         xdata = [datetime.datetime(year=2010+int(i/12), month=i%12+1, day=1) for i in range(startidx, lastidx+1)]
         ydata = [month["sum"]/max(1, month["count"]) for month in agg["sentiment"][char]["months"][startidx:lastidx+1] ]
         if do_smooth:
-            ydata = smooth(month_data=ydata)
+            ydata = lowpass(ydata, month_fc, zero_phase=True)
         pdata[char] = [xdata, ydata]
 
     # Plot data
@@ -157,24 +126,24 @@ def text_senti_by_storyarc(agg, chars=("text",), do_smooth=False, arcs=("",)):
         _long=">{} sentences".format(story_length.med)
     )
 
-    # Prepare data
+    # Prepare data, as a (series x percent) array
+    series = [(char, arc) for char in chars for arc in arcs]
+    all_ydata = np.array([[percent["sum"]/max(1, percent["count"])
+        for percent in agg["sentiment"][char]["storyarc_percent" + arc]] for char, arc in series])
+    if do_smooth:
+        all_ydata = lowpass(all_ydata, percent_fc, zero_phase=True)
     pdata = {}
-    for char in chars:
-        for arc in arcs:
-            percdata = agg["sentiment"][char]["storyarc_percent" + arc]
-            xdata = range(101)
-            ydata = [percent["sum"]/max(1, percent["count"]) for percent in percdata ]
-            if do_smooth:
-                ydata = smooth(percent_data=ydata)
-            if len(arcs) == 1:
-                lbl = char
-            elif len(chars) == 1:
-                lbl = storyarc_length_map[arc]
-            else:
-                # Have multiple characters AND bins
-                lbl = "{} ({})".format(char, storyarc_length_map[arc])
-
-            pdata[lbl] = [xdata, ydata]
+    for (char, arc), ydata in zip(series, all_ydata):
+        xdata = range(101)
+        if len(arcs) == 1:
+            lbl = char
+        elif len(chars) == 1:
+            lbl = storyarc_length_map[arc]
+        else:
+            # Have multiple characters AND bins
+            lbl = "{} ({})".format(char, storyarc_length_map[arc])
+
+        pdata[lbl] = [xdata, ydata]
 
     # Plot data
     for char, cdata in pdata.items():
@@ -197,10 +166,10 @@ def story_lengths(index, agg, log_bins=True, metric="words"):
 
     plt.figure(figsize=(14, 8), dpi=192)
     if metric == "words":
-        lengths = [s["words"] for s in index.values()]
+        lengths = index["words"].tolist()
     else:
         lengths = agg["story_lengths"]
-    lengths.sort()
+    lengths = sorted(lengths)
     # As of now, there are only 6 stories > 100000 sentences in length:
     # 100545, 106312, 106491, 133191, 136195, 151190 sentences
     # They are not even visible on a histogram
@@ -260,15 +229,9 @@ def char_pairs(agg):
 def most_common_words(agg, char="text"):
     """Plot the words most commonly associated with the given character
     """
-    # Create counts of all words that are found alongside ANY character
-    all_words = {}
-    for c in characters:
-        for w, v in agg["associations"][c].items():
-            all_words[w] = all_words.get(w, 0) + v
-    # Normalize:
-    num_words = sum(all_words.values())
-    for k, v in all_words.items():
-        all_words[k] = v/num_words
+    # Normalized counts of all words that are found alongside ANY
+    # character (computed by aggregate.py)
+    all_words = agg["pooled_frequencies"]
 
     def is_nontrivial_word(w, norm):
         """Avoid reporting uninteresting words.
@@ -278,9 +241,9 @@ def most_common_words(agg, char="text"):
     assoc = agg["associations"][char]
     num_words = sum(assoc.values())
     # Filter non-interesting words and ones which are part of the character's name
-    ranked = sorted(assoc.keys(), key=lambda w: assoc[w], reverse=True)
-    eligible = (w for w in ranked if is_nontrivial_word(w, norm=assoc[w]/num_words) and w not in char.lower().split(" "))
-    top = [next(eligible) for i in range(20)]
+    name = char.lower().split(" ")
+    eligible = (w for w in assoc if is_nontrivial_word(w, norm=assoc[w]/num_words) and w not in name)
+    top = heapq.nlargest(20, eligible, key=assoc.get)
 
     for idx, word in enumerate(top):
         plt.bar(idx, assoc[word], label="#{}. {}".format(1+idx, word))
@@ -298,21 +261,13 @@ def most_common_words(agg, char="text"):
 def most_common_nonwords(agg, char="text"):
     """Plot the most common non-words
     """
-    dictionary = enchant.Dict("en_US")
-    def is_nonword(w):
-        if w == "": return False
-        is_nw = w not in fim_words and not dictionary.check(w) \
-          and not any(similar.lower().replace("-","")==w for similar in dictionary.suggest(w))
-        if w.endswith("'s"):
-            is_nw = is_nw and is_nonword(w[:-2])
-        if "-" in w:
-            is_nw = is_nw and any(is_nonword(k) for k in w.split("-"))
-        return is_nw
+    global nonwords
+    if nonwords is None:
+        nonwords = NonwordCache(nonword_cache_path, fim_words)
 
     assoc = agg["associations"][char]
     ranked = sorted(assoc.keys(), key=lambda w: assoc[w], reverse=True)
-    eligible = (w for w in ranked if is_nonword(w))
-    top = [next(eligible) for i in range(20)]
+    top = nonwords.first_nonwords(ranked, 20)
 
     for idx, word in enumerate(top):
         plt.bar(idx, assoc[word], label="#{}. {}".format(1+idx, word))
@@ -328,48 +283,53 @@ def most_common_nonwords(agg, char="text"):
 
     plt.legend(loc="best", prop=legendFont, ncol=2)
 
-def rating_vs_length(index, metric="words", method="scatter"):
+def rating_vs_length(index, metric="words", method="scatter", window=10000, stride=500, weighted=False):
     """Plot a histogram of avg like:(like+dislike) ratio vs length of story.
     metric can be "words" or "titlelen" or "date".
-    method can be "linear" or "scatter" to indicate the display formate.
+    method can be "linear", "scatter" or "density" to indicate the display
+    format. "density" shades a grid of bins by their number of stories,
+    which takes the same time and space however many stories there are.
+    "linear" plots the average rating of every window stories (by length),
+    every stride stories, weighted by their number of votes if weighted.
     """
-    # (length, like:dislike)
-    dpoints = []
-    for story in index.values():
-        valid, rating = story_rating(story, 1)
-        if valid:
-            if metric == "words":
-                x = story["words"]
-            if metric == "titlelen":
-                # Titles can somehow be None.
-                x = len(story["title"] or "")
-            if metric == "date":
-                chapters = story["chapters"]
-                x = sum(c["date_modified"] for c in chapters)/len(chapters)
-            dpoints.append((x, rating))
-
-    dpoints.sort(reverse=True)
-
-    if method=="scatter":
-        # Only select a few points to avoid over-crowding.
-        x, y = [i[0] for i in dpoints], [i[1] for i in dpoints]
-        plt.scatter(x, y, alpha=0.1)
+    # Only rate stories with at least one like or dislike
+    valid = index["votes"] >= 1
+    if metric == "words":
+        x = index["words"]
+    if metric == "titlelen":
+        x = index["title_length"]
+    if metric == "date":
+        x = index["date"]
+    x, ratings = x[valid], index["rating"][valid]
+
+    if method == "density":
+        if metric == "words":
+            xbins = np.logspace(2, 6, density_bins[0]+1)
+        else:
+            low = x.min(initial=0)
+            xbins = np.linspace(low, max(x.max(initial=1), low+1), density_bins[0]+1)
+        counts, xbins, ybins = np.histogram2d(x, ratings, bins=(xbins, np.linspace(-1, 1, density_bins[1]+1)))
+        # Empty bins are left blank, and the scale starts at one story and
+        # spans at least a decade however few stories there are
+        norm = LogNorm(vmin=1, vmax=max(10, counts.max(initial=0)))
+        plt.pcolormesh(xbins, ybins, np.ma.masked_equal(counts.T, 0), norm=norm, cmap="Blues")
+        plt.colorbar(label="Stories")
+        plt.ylim(-1, 1)
+    elif method=="scatter":
+        plt.scatter(x, ratings, alpha=0.1)
         plt.ylim(-1, 1)
         #plt.hexbin(x, y, xscale=xscale, gridsize=32)
     else:
-        # Slice the datapoints to sample the average ratio at discrete ranges
-        plot_points = []
-        slice_size = 10000
-        slice_distance = 500
-        for i in range(0, len(dpoints)-slice_size+1, slice_distance):
-            rng = dpoints[i:i+slice_size]
-            avg_length = sum(i[0] for i in rng)/len(rng)
-            if metric == "date":
-                avg_length = datetime.datetime.fromtimestamp(avg_length)
-            avg_rating = sum(i[1] for i in rng)/len(rng)
-            plot_points.append((avg_length, avg_rating))
+        # Slide a window over the stories, from the longest, to sample
+        # the average ratio at discrete ranges
+        order = np.lexsort((ratings, x))[::-1]
+        weights = index["votes"][valid][order] if weighted else None
+        avg_lengths = sliding_means(x[order], window, stride, weights).tolist()
+        avg_ratings = sliding_means(ratings[order], window, stride, weights).tolist()
+        if metric == "date":
+            avg_lengths = [datetime.datetime.fromtimestamp(t) for t in avg_lengths]
         plot_func = plt.plot_date if metric == "date" else plt.plot
-        plot_func([i[0] for i in plot_points], [i[1] for i in plot_points], '-', lw=2.5)
+        plot_func(avg_lengths, avg_ratings, '-', lw=2.5)
 
     # Labels
     plt.ylabel("(likes-dislikes) / (likes+dislikes)")
@@ -392,8 +352,7 @@ def most_common_titles(index):
     """
 
     titles = {}
-    for story in index.values():
-        t = story["title"]
+    for t in index.titles():
         titles[t] = titles.get(t, 0) + 1
 
     top = list(titles.items())
@@ -415,12 +374,8 @@ def story_status_distr(index):
     """
     plt.figure(figsize=(10, 8), dpi=192)
 
-    statuses = {}
-    for story in index.values():
-        s = story["status"]
-        statuses[s] = statuses.get(s, 0) + 1
-
-    statuses = sorted(statuses.items())
+    counts = np.bincount(index["status"], minlength=len(index.statuses))
+    statuses = [s for s in zip(index.statuses, counts.tolist()) if s[1]]
     explode = [2000/(25000+s[1]) for s in statuses]
     plt.pie([s[1] for s in statuses], labels=[s[0] for s in statuses], explode=explode, autopct='%1.0f%%')
 
@@ -433,15 +388,12 @@ def rating_vs_char(index, agg, chars=main6):
     So so for each character & plot adjacently.
     """
     char_ratings = {}
+    char_stories = Membership(agg["char_stories"], agg["stories"])
     for c in chars:
-        counts = agg["char_mentions"][c]["in_stories"]
         # extract the stories in which the character appears
-        in_stories = [k for (k, count) in counts.items() if count]
-        ratings = []
-        for story_id in in_stories:
-            valid, rating = story_rating(index[story_id])
-            if valid:
-                ratings.append(rating)
+        rows = index.rows_of(char_stories.stories_of(c))
+        valid = index["votes"][rows] >= 1
+        ratings = index["rating"][rows][valid].tolist()
         print("found {} valid ratings for {}, avg: {}".format(len(ratings), c, mean(ratings)))
         char_ratings[c] = mean(ratings)
 
@@ -498,11 +450,11 @@ figure_functions = { \
     "most_common_nonwords_rd.png": lambda agg: most_common_nonwords(agg, "Rainbow Dash"),
     "most_common_nonwords_ra.png": lambda agg: most_common_nonwords(agg, "Rarity"),
     "most_common_nonwords_ts.png": lambda agg: most_common_nonwords(agg, "Twilight Sparkle"),
-    "rating_vs_length.png": rating_vs_length,
+    "rating_vs_length.png": lambda index: rating_vs_length(index, method="density"),
     "rating_vs_length_linear.png": lambda index: rating_vs_length(index, method="linear"),
-    "rating_vs_title_length.png": lambda index: rating_vs_length(index, "titlelen"),
+    "rating_vs_title_length.png": lambda index: rating_vs_length(index, "titlelen", method="density"),
     "rating_vs_title_length_linear.png": lambda index: rating_vs_length(index, "titlelen", method="linear"),
-    "rating_vs_date.png": lambda index: rating_vs_length(index, "date"),
+    "rating_vs_date.png": lambda index: rating_vs_length(index, "date", method="density"),
     "rating_vs_date_linear.png": lambda index: rating_vs_length(index, "date", method="linear"),
     "most_common_titles.png": most_common_titles,
     "story_status_distr.png": story_status_distr,
@@ -511,23 +463,100 @@ figure_functions = { \
 }
 
 
+def inputs_of(gen_figure):
+    """Return the names of the data ("index", "agg") gen_figure is drawn from"""
+    args = inspect.getfullargspec(gen_figure).args
+    return [name for name in ("index", "agg") if name in args]
+
+def render(out_path, data):
+    """Draw the figure named after out_path from data, a dict with the
+    index table and aggregate, and save it to out_path.
+    """
+    gen_figure = figure_functions[os.path.split(out_path)[-1]]
+    plt.figure(figsize=(12, 8), dpi=192)
+    try:
+        gen_figure(**{name: data[name] for name in inputs_of(gen_figure)})
+        plt.savefig(out_path)
+    finally:
+        plt.close("all")
+
+# The data of render_all, which forked workers inherit instead of loading
+shared_data = {}
+
+# The modules of this repo which the figures are drawn with
+source_modules = ("common", "index_table", "membership", "nonwords", "smoothing", "store")
+
+def render_shared(out_path):
+    """Render out_path, returning (out_path, error message or None)"""
+    try:
+        render(out_path, shared_data)
+    except Exception as e:
+        return out_path, "{}: {}".format(type(e).__name__, e)
+    return out_path, None
+
+def render_all(index_path, aggregated_path, out_dir, num_workers):
+    """Render every figure of figure_functions into out_dir, using
+    num_workers processes. Figures which are newer than the data they
+    are drawn from and the code drawing them are left as they are.
+    Returns the number of figures which failed.
+    """
+    paths = dict(index=index_path, agg=aggregated_path)
+    code = [os.path.abspath(__file__)] + [sys.modules[m].__file__ for m in source_modules]
+    def outdated(name):
+        inputs = code + [paths[i] for i in inputs_of(figure_functions[name])]
+        try:
+            return os.path.getmtime(os.path.join(out_dir, name)) < max(map(os.path.getmtime, inputs))
+        except OSError:
+            return True
+    names = [name for name in figure_functions if outdated(name)]
+    print("figures to render: {} of {}".format(len(names), len(figure_functions)))
+    needed = {i for name in names for i in inputs_of(figure_functions[name])}
+
+    # Load the data once, up front, so that the workers share it
+    if "index" in needed:
+        shared_data["index"] = IndexTable(index_path)
+    if "agg" in needed:
+        agg = open_aggregate(aggregated_path)
+        # Decode every section of a store, and the words of every character
+        for section in agg.values():
+            if isinstance(section, Mapping):
+                for _ in section.values():
+                    pass
+        shared_data["agg"] = agg
+
+    os.makedirs(out_dir, exist_ok=True)
+    out_paths = [os.path.join(out_dir, name) for name in names]
+    failures = 0
+    with multiprocessing.get_context("fork").Pool(num_workers) as pool:
+        for out_path, error in pool.imap_unordered(render_shared, out_paths):
+            if error is not None:
+                print("Error rendering {}: {}".format(out_path, error))
+                failures += 1
+            else:
+                print("rendered", out_path)
+    return failures
+
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: {} <index.json> <aggregated.json> <output image file>".format(sys.argv[0]))
+    if len(sys.argv) in (5, 6) and sys.argv[1] == "--all":
+        index_path, aggregated_path, out_dir = sys.argv[2:5]
+        num_workers = int(sys.argv[5]) if len(sys.argv) == 6 else os.cpu_count()
+        nonword_cache_path = os.path.join(os.path.dirname(aggregated_path), "nonwords.json")
+        failures = render_all(index_path, aggregated_path, out_dir, num_workers)
+        sys.exit(1 if failures else 0)
+    elif len(sys.argv) != 4:
+        print("Usage: {} <index table> <aggregated.json> <output image file>".format(sys.argv[0]))
+        print("       {} --all <index table> <aggregated.json> <output dir> [<num workers>]".format(sys.argv[0]))
+        print("--all: render every figure whose data changed, in parallel")
     else:
         index_path, aggregated_path, out_path = sys.argv[1:]
         gen_figure = figure_functions[os.path.split(out_path)[-1]]
-
-        # Lazy-load aggregated.json and index.json
-        argspec = inspect.getargspec(gen_figure)
-        need_agg, need_index = "agg" in argspec[0], "index" in argspec[0]
-
-        kwargs = {}
-        if need_agg:
-            kwargs["agg"] = json.loads(open(aggregated_path, "r").read())
-        if need_index:
-            kwargs["index"] = json.loads(open(index_path, "r").read())
-
-        plt.figure(figsize=(12, 8), dpi=192)
-        out_figure = gen_figure(**kwargs)
-        plt.savefig(out_path)
+        nonword_cache_path = os.path.join(os.path.dirname(aggregated_path), "nonwords.json")
+
+        # Lazy-load aggregated.json and the index table. Only the sections of
+        # the aggregate which the figure looks up are read (see store.py)
+        data = {}
+        if "agg" in inputs_of(gen_figure):
+            data["agg"] = open_aggregate(aggregated_path)
+        if "index" in inputs_of(gen_figure):
+            data["index"] = IndexTable(index_path)
+        render(out_path, data)
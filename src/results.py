@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Compact binary container for the results of the per-story analyses.
+
+A .results file holds the same information as a story's .sentiment.json
+and .words.json files:
+
+    magic (4 bytes) | version (u32) | header length (u32) | header | data
+
+The header is a small JSON object holding the averages and char_pairs,
+and the location of every array inside the data section. The data
+section holds the sentiment of each sentence as float32 arrays, every
+word of the story (newline-separated) and, for each character, the
+indices of its words and their counts as uint32 arrays. Arrays are
+4-byte aligned so that they can be used straight out of a memory-mapped
+file.
+"""
+
+import json, mmap, os, struct, sys, time
+import numpy as np
+
+from common import write_atomic
+
+magic = b"FIMR"
+version = 1
+prefix = struct.Struct("<4sII")
+
+def write_results(path, senti_dict, words_dict):
+    """Write the results of analyze_senti and analyze_words to path"""
+    sentiment = senti_dict["sentiment"]
+    associations = words_dict["associations"]
+    header = {"avg": {}, "sentiment": {}, "associations": {}, "char_pairs": words_dict["char_pairs"]}
+    chunks = []
+    size = 0
+    def add(data):
+        """Append data (aligned) to the data section and return its offset"""
+        nonlocal size
+        offset = size
+        chunks.append(data)
+        chunks.append(b"\0" * (-len(data) % 4))
+        size += len(data) + len(chunks[-1])
+        return offset
+
+    for c, p in sentiment.items():
+        raw = np.asarray(p["raw"], dtype="<f4")
+        header["avg"][c] = p["avg"]
+        header["sentiment"][c] = [add(raw.tobytes()), len(raw)]
+
+    # Every word of the story, stored once
+    vocab = {}
+    for counts in associations.values():
+        for w in counts:
+            vocab.setdefault(w, len(vocab))
+    words = "\n".join(vocab).encode()
+    header["words"] = [add(words), len(words)]
+    for c, counts in associations.items():
+        idx = np.fromiter((vocab[w] for w in counts), dtype="<u4", count=len(counts))
+        num = np.fromiter(counts.values(), dtype="<u4", count=len(counts))
+        header["associations"][c] = [add(idx.tobytes()), add(num.tobytes()), len(counts)]
+
+    header = json.dumps(header).encode()
+    # Align the data section
+    header += b" " * (-(prefix.size + len(header)) % 4)
+    write_atomic(path, b"".join([prefix.pack(magic, version, len(header)), header] + chunks))
+
+def read_results(path, sparse=False):
+    """Return the (sentiment, word-association) dicts stored at path, laid
+    out as in the .sentiment.json and .words.json files. The "raw"
+    sentiment lists are float32 arrays backed by the memory-mapped file.
+    If sparse is set, the word-association dict instead has a "words"
+    list, and each character's associations are an (indices into words,
+    counts) pair of arrays.
+    """
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    file_magic, file_version, header_len = prefix.unpack_from(buf)
+    if (file_magic, file_version) != (magic, version):
+        raise ValueError("{} is not a version {} results file".format(path, version))
+    header = json.loads(buf[prefix.size:prefix.size+header_len].decode())
+    data = prefix.size + header_len
+
+    sentiment = {}
+    for c, (offset, count) in header["sentiment"].items():
+        raw = np.frombuffer(buf, dtype="<f4", count=count, offset=data+offset)
+        sentiment[c] = {"raw": raw, "avg": header["avg"][c]}
+
+    offset, length = header["words"]
+    words = buf[data+offset:data+offset+length].decode().split("\n") if length else []
+    associations = {}
+    for c, (idx_offset, num_offset, count) in header["associations"].items():
+        idx = np.frombuffer(buf, dtype="<u4", count=count, offset=data+idx_offset)
+        num = np.frombuffer(buf, dtype="<u4", count=count, offset=data+num_offset)
+        if sparse:
+            associations[c] = idx, num
+        else:
+            associations[c] = dict(zip([words[i] for i in idx.tolist()], num.tolist()))
+
+    words_dict = dict(associations=associations, char_pairs=header["char_pairs"])
+    if sparse:
+        words_dict["words"] = words
+    return dict(sentiment=sentiment), words_dict
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("Usage: {} <.results file> <.sentiment.json file> <.words.json file>".format(sys.argv[0]))
+        print("Compare the size and parse time of the two formats for one story.")
+    else:
+        results_path, senti_path, words_path = sys.argv[1:]
+        t0 = time.perf_counter()
+        read_results(results_path)
+        t1 = time.perf_counter()
+        json.loads(open(senti_path, "r").read())
+        json.loads(open(words_path, "r").read())
+        t2 = time.perf_counter()
+        print("results: {} bytes, parsed in {:.2f} ms".format(
+            os.path.getsize(results_path), 1000*(t1-t0)))
+        print("json:    {} bytes, parsed in {:.2f} ms".format(
+            os.path.getsize(senti_path) + os.path.getsize(words_path), 1000*(t2-t1)))
@@ -0,0 +1,152 @@
+"""Splits story text into sentences for the per-story analyses.
+
+Sentence tokenization is costly, so the first time a story's sentences
+are requested through story_sentences() their byte offsets are saved to
+a small sidecar file next to the text (<story>.sentidx). Later analyses
+memory-map the text and read the sentences straight from those offsets.
+The sidecar records the size and mtime of the text it was made from and
+is ignored (and rewritten) once the text changes.
+"""
+
+import mmap, os, struct, sys
+from array import array
+
+import nltk
+from nltk import tokenize
+
+from common import attribute_sentence_to_char, write_atomic
+
+# Number of chars read from a story at a time
+chunk_size = 1<<16
+
+# magic, version, text size, text mtime (ns), number of sentences
+index_header = struct.Struct("<4sIQQQ")
+index_magic = b"SIDX"
+index_version = 1
+
+_punkt = None
+
+def punkt_tokenizer():
+    """Return the pretrained Punkt tokenizer used by tokenize.sent_tokenize"""
+    global _punkt
+    if _punkt is None:
+        if hasattr(tokenize, "PunktTokenizer"):
+            # nltk >= 3.8.2 no longer loads pickled models
+            _punkt = tokenize.PunktTokenizer("english")
+        else:
+            _punkt = nltk.data.load("tokenizers/punkt/english.pickle")
+    return _punkt
+
+def _sentences_and_gaps(f):
+    """Yield (gap, sentence) for each sentence of the file f, where gap is
+    the text between the end of the previous sentence and this one.
+    """
+    tokenizer = punkt_tokenizer()
+    buf = ""
+    # Text between the last yielded sentence and the start of buf
+    gap = ""
+    # End of the last yielded sentence within buf
+    done = 0
+    while True:
+        # Read at least as much as is buffered so that a single huge
+        # sentence isn't re-tokenized over and over
+        chunk = f.read(max(chunk_size, len(buf)))
+        if not chunk:
+            break
+        buf += chunk
+        spans = list(tokenizer.span_tokenize(buf))
+        # The last sentence may continue into the next chunk, and
+        # whether the one before it really ends where Punkt thinks
+        # depends on the (possibly truncated) word that follows, so
+        # hold both back until more text has been read.
+        for start, end in spans[:-2]:
+            yield gap + buf[done:start], buf[start:end]
+            gap = ""
+            done = end
+        if len(spans) > 2:
+            # Punkt needs to see the held back sentences from their start
+            gap += buf[done:spans[-2][0]]
+            buf = buf[spans[-2][0]:]
+            done = 0
+    for start, end in tokenizer.span_tokenize(buf):
+        yield gap + buf[done:start], buf[start:end]
+        gap = ""
+        done = end
+
+def iter_sentences(f):
+    """Yield the sentences of the file f, reading it a chunk at a time,
+    so that huge stories don't need to be held in memory all at once.
+    The sentences are the same as tokenize.sent_tokenize(f.read()).
+    """
+    for gap, sentence in _sentences_and_gaps(f):
+        yield sentence
+
+def index_path(text_path):
+    """Return the path of the sentence index of the text file at text_path"""
+    return text_path.replace(".ansi.txt", "") + ".sentidx"
+
+def read_index(text_path):
+    """Return the array of (start, end) byte offsets of the sentences of
+    text_path, flattened, or None if there is no up-to-date index.
+    """
+    try:
+        st = os.stat(text_path)
+        with open(index_path(text_path), "rb") as f:
+            magic, version, size, mtime, count = index_header.unpack(f.read(index_header.size))
+            if (magic, version, size, mtime) != (index_magic, index_version, st.st_size, st.st_mtime_ns):
+                return None
+            offsets = array("I")
+            offsets.frombytes(f.read())
+    except (OSError, struct.error, ValueError):
+        return None
+    if len(offsets) != 2*count:
+        return None
+    if sys.byteorder == "big":
+        offsets.byteswap()
+    return offsets
+
+def write_index(text_path, offsets, st):
+    """Save the flattened sentence offsets of text_path, whose stat()
+    at the time it was read is st.
+    """
+    path = index_path(text_path)
+    if sys.byteorder == "big":
+        offsets = array("I", offsets)
+        offsets.byteswap()
+    write_atomic(path, index_header.pack(index_magic, index_version, st.st_size, st.st_mtime_ns, len(offsets)//2)
+        + offsets.tobytes())
+
+def story_sentences(text_path):
+    """Yield the sentences of the story at text_path, using its sentence
+    index if it is up to date, or creating it otherwise.
+    """
+    offsets = read_index(text_path)
+    if offsets is None:
+        # Tokenize, noting the byte offsets of each sentence as we go
+        st = os.stat(text_path)
+        offsets = array("I")
+        pos = 0
+        with open(text_path, encoding="utf-8", errors="surrogateescape", newline="") as f:
+            for gap, sentence in _sentences_and_gaps(f):
+                pos += len(gap.encode("utf-8", "surrogateescape"))
+                offsets.append(pos)
+                pos += len(sentence.encode("utf-8", "surrogateescape"))
+                offsets.append(pos)
+                yield sentence
+        write_index(text_path, offsets, st)
+    elif offsets:
+        with open(text_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as text:
+            for i in range(0, len(offsets), 2):
+                yield text[offsets[i]:offsets[i+1]].decode("utf-8", "surrogateescape")
+
+def attribute(sentences):
+    """Yield (characters, sentence) for every sentence, where the
+    characters' names have been removed from the sentence (see
+    common.attribute_sentence_to_char).
+    """
+    for s in sentences:
+        yield attribute_sentence_to_char(s)
+
+def attributed_sentences(f):
+    """attribute() the sentences of the file f"""
+    return attribute(iter_sentences(f))
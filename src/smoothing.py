@@ -0,0 +1,77 @@
+"""Low-pass filtering of sampled series, to make long-term trends visible.
+
+The filter is a second order Butterworth low-pass, as described in
+http://www.claysturner.com/dsp/Butterworth%20Filter%20Formulae.pdf
+It is applied along the last axis of an array, so a whole (character x
+sample) array is filtered at once: the feed-forward half is computed for
+every sample with array operations, and only the feedback recursion
+steps through the samples, on all rows together.
+
+sliding_means averages sorted data over a sliding window, for trend
+lines of scattered data.
+"""
+
+from math import cos, pi, tan
+import numpy as np
+
+def butterworth(fc):
+    """Return the (feed-forward, feedback) coefficients of the filter with
+    cutoff frequency fc, in cycles per sample, such that
+        y[n] = sum(b[k] x[n-k]) - sum(a[k] y[n-k] for k >= 1)
+    """
+    c = 1/tan(pi*fc)
+    alpha = 2*cos(pi/4)
+    DC = 1/(1+c*(c+alpha))
+    b = [DC, 2*DC, DC]
+    a = [1, 2*(1-c*c)/(1+c*(c+alpha)), (1+c*(c-alpha))/(1+c*(c+alpha))]
+    return b, a
+
+def _filter(x, fc):
+    """Filter x forwards along its last axis. Samples before the first
+    are assumed to be steady at its value.
+    """
+    b, a = butterworth(fc)
+    DC = b[0]
+    # x[n-1] and x[n-2], clamped to the first sample
+    x1 = np.concatenate((x[..., :1], x[..., :-1]), axis=-1)
+    x2 = np.concatenate((x[..., :1], x1[..., :-1]), axis=-1)
+    rhs = DC*(x + x1*2 + x2)
+    y = np.empty_like(x)
+    if x.shape[-1]:
+        y[..., 0] = x[..., 0]
+    for n in range(1, x.shape[-1]):
+        y[..., n] = rhs[..., n] - (y[..., n-1]*a[1] + y[..., max(0, n-2)]*a[2])
+    return y
+
+def lowpass(data, fc, zero_phase=False):
+    """Return data (a sequence, or an array of series) low-pass filtered
+    along its last axis, with cutoff frequency fc in cycles per sample
+    (e.g. 1/12 to see trends longer than a year in monthly data).
+    If zero_phase is set, data is filtered forwards and then backwards,
+    which cancels the filter's delay (and squares its response).
+    """
+    x = np.asarray(data, dtype=float)
+    y = _filter(x, fc)
+    if zero_phase:
+        y = _filter(y[..., ::-1], fc)[..., ::-1]
+    return y
+
+def sliding_means(data, window, stride=1, weights=None):
+    """Return the mean of every window of window consecutive samples of
+    data (a sequence, or an array of series) along its last axis, the
+    windows starting every stride samples. Means are weighted by weights
+    (of the same shape as data), if given. Each mean is a difference of
+    cumulative sums, so the cost doesn't depend on window.
+    """
+    x = np.asarray(data, dtype=float)
+    starts = np.arange(0, x.shape[-1]-window+1, stride)
+    if weights is None:
+        weights = np.ones_like(x)
+    else:
+        weights = np.broadcast_to(np.asarray(weights, dtype=float), x.shape)
+        x = x*weights
+    zero = np.zeros(x.shape[:-1] + (1,))
+    sums = np.concatenate((zero, np.cumsum(x, axis=-1)), axis=-1)
+    totals = np.concatenate((zero, np.cumsum(weights, axis=-1)), axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums[..., starts+window] - sums[..., starts]) / (totals[..., starts+window] - totals[..., starts])
@@ -0,0 +1,154 @@
+"""Sectioned store of aggregated data, loaded lazily.
+
+aggregated.json is a small JSON header next to a directory of arrays
+(aggregated.arrays/, one .npy file per array). The header holds the
+small sections of the aggregate as they are, and the names of the arrays
+making up the others (sentiment, story lengths, memberships, word
+associations and frequencies).
+
+open_aggregate() returns a read-only mapping with the same layout as
+the monolithic aggregated.json written by aggregate.py --json. A section
+is only read and decoded the first time it is looked up, and the arrays
+are memory-mapped, so reading a store costs the same however large its
+vocabulary is, until the word associations are actually used.
+"""
+
+import json, os, shutil
+from collections.abc import Mapping
+import numpy as np
+
+version = 1
+
+def arrays_dir(path):
+    """Return the directory of the arrays of the store at path"""
+    return os.path.splitext(path)[0] + ".arrays"
+
+def read_array(path, name):
+    """Return the array name of the store at path, memory-mapped"""
+    return np.load(os.path.join(arrays_dir(path), name + ".npy"), mmap_mode="r")
+
+def write_store(path, header, arrays):
+    """Write a store of the JSON-friendly dict header and the dict of
+    name -> numpy array arrays to path.
+    """
+    directory = arrays_dir(path)
+    shutil.rmtree(directory + ".tmp", ignore_errors=True)
+    os.makedirs(directory + ".tmp")
+    for name, array in arrays.items():
+        np.save(os.path.join(directory + ".tmp", name + ".npy"), array)
+    with open(path + ".tmp", "w") as f:
+        f.write(json.dumps(dict(header, store_version=version, arrays=sorted(arrays))))
+    # Everything new is written before anything old is touched, and the
+    # old arrays are only removed once the new store is in place, so
+    # that an interrupted write never leaves no aggregate at all
+    shutil.rmtree(directory + ".old", ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, directory + ".old")
+    os.rename(directory + ".tmp", directory)
+    os.replace(path + ".tmp", path)
+    shutil.rmtree(directory + ".old", ignore_errors=True)
+
+class AggregateStore(Mapping):
+    """The aggregate stored at path, whose header is header"""
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+        self.sections = {}
+        self.words = None
+        self.decoders = dict(
+            sentiment=self._sentiment,
+            story_lengths=lambda: self.array("story_lengths").tolist(),
+            stories=lambda: [str(story_id) for story_id in self.array("stories").tolist()],
+            char_stories=lambda: self._membership("char_stories"),
+            pair_stories=lambda: self._membership("pair_stories"),
+            associations=lambda: Associations(self),
+            pooled_frequencies=self._pooled_frequencies,
+        )
+        # The header's own entries, which aren't sections
+        layout = ("store_version", "arrays", "characters", "sentiment_series", "memberships")
+        self.names = [k for k in header if k not in layout] + list(self.decoders)
+
+    def array(self, name):
+        """Return the array name, memory-mapped"""
+        return read_array(self.path, name)
+
+    def __getitem__(self, key):
+        if key not in self.sections:
+            if key in self.decoders:
+                self.sections[key] = self.decoders[key]()
+            elif key in self.names:
+                self.sections[key] = self.header[key]
+            else:
+                raise KeyError(key)
+        return self.sections[key]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _sentiment(self):
+        series = {name: (self.array("sentiment." + name + ".sum").tolist(),
+                self.array("sentiment." + name + ".count").tolist())
+            for name in self.header["sentiment_series"]}
+        return {c: {name: [{"sum": total, "count": count} for total, count in zip(sums[ci], counts[ci])]
+                for name, (sums, counts) in series.items()}
+            for ci, c in enumerate(self.header["characters"])}
+
+    def words_of(self, ids):
+        """Return the words of the array of word ids"""
+        if self.words is None:
+            # Word i is words[offsets[i]:offsets[i+1]], utf-8 encoded
+            self.words = memoryview(self.array("words"))
+            self.offsets = self.array("words.offsets")
+        words = self.words
+        return [bytes(words[a:b]).decode() for a, b in
+            zip(self.offsets[ids].tolist(), self.offsets[ids+1].tolist())]
+
+    def _pooled_frequencies(self):
+        frequencies = self.array("pooled_frequencies")
+        ids = np.flatnonzero(frequencies)
+        return dict(zip(self.words_of(ids), frequencies[ids].tolist()))
+
+    def _membership(self, name):
+        table = {part: self.array(name + "." + part) for part in ("indptr", "rows", "counts")}
+        table["names"] = self.header["memberships"][name]
+        return table
+
+class Associations(Mapping):
+    """char -> {word: count} of a store, decoding only the words of the
+    characters which are looked up.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.chars = {c: ci for ci, c in enumerate(store.header["characters"])}
+        self.indptr = store.array("associations.indptr")
+        self.ids = store.array("associations.ids")
+        self.counts = store.array("associations.counts")
+        self.decoded = {}
+
+    def __getitem__(self, c):
+        if c not in self.decoded:
+            ci = self.chars[c]
+            start, end = self.indptr[ci], self.indptr[ci+1]
+            self.decoded[c] = dict(zip(self.store.words_of(self.ids[start:end]),
+                self.counts[start:end].tolist()))
+        return self.decoded[c]
+
+    def __iter__(self):
+        return iter(self.chars)
+
+    def __len__(self):
+        return len(self.chars)
+
+def open_aggregate(path):
+    """Return the aggregate at path, either a store (read lazily) or a
+    monolithic aggregated.json.
+    """
+    header = json.loads(open(path, "r").read())
+    if "store_version" not in header:
+        return header
+    if header["store_version"] != version:
+        raise ValueError("{} is not a version {} aggregate store".format(path, version))
+    return AggregateStore(path, header)
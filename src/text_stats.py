@@ -4,6 +4,8 @@
 
 import json, sys
 
+from store import open_aggregate
+
 def word_frequencies(agg):
     """Across the entire text, create a dict that maps word -> frequency (float)
     """
@@ -28,7 +30,7 @@ if __name__ == "__main__":
         print("Usage: {} <aggregated.json> <target_name>".format(sys.argv[0]))
     else:
         aggregated_path, target_name = sys.argv[1:]
-        agg = json.loads(open(aggregated_path, "r").read())
+        agg = open_aggregate(aggregated_path)
 
         func = text_functions[target_name]
         data = func(agg)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""Scores the sentiment of many sentences at once.
+
+VADER's SentimentIntensityAnalyzer scores one sentence at a time in pure
+Python, which makes it the slowest part of the analysis. BatchScorer
+computes the same compound scores for a whole list of sentences: every
+distinct token gets an integer id, the properties VADER looks up for each
+word (lexicon valence, booster value, negation, ...) are stored in arrays
+indexed by that id, and the booster, negation, "but" and punctuation rules
+are then applied to every token of the batch at once with numpy.
+
+The few sentences which rely on VADER's rarer rules (idioms, "least",
+"never so") are scored by the reference implementation instead, so the
+results are the same either way.
+"""
+
+import itertools, re, string, sys, time, warnings
+import numpy as np
+
+with warnings.catch_warnings():
+    # The nltk.twitter library emits a completely irrelevant warning
+    # about not having twython installed; silence that.
+    warnings.simplefilter("ignore", UserWarning)
+    from nltk.sentiment import vader
+
+# Sentences exercising each of the vectorized rules. The batch scores of
+# these are compared against the reference when a BatchScorer is created.
+probe_sentences = [
+    "",
+    "Yes.",
+    "it smiled.",
+    "This is good.",
+    "This is not good at all!",
+    "it isn't very happy, but it is EXTREMELY glad!!",
+    "I am so happy, this is very GOOD.",
+    "it was kind of sad; sort of ok.",
+    "But it was a good day. But a bad night?",
+    "Good but bad, BUT great and not horrible.",
+    "\"Wonderful,\" it said; 'terrible.' (awful) -- ok...",
+    "HAPPY DAYS ARE HERE.",
+    "Why?? Why would you do this??? I hate it!!!!!",
+    "Hardly good, barely nice, totally AWESOME and utterly dreadful.",
+    "it was the least bit scary, and not so nice, nor kind.",
+    "Good, not good; not very good, but good.",
+]
+
+class BatchScorer:
+    """Computes the same compound scores as sid.polarity_scores, for many
+    sentences at a time.
+    """
+    # Lower-cased words that make VADER apply a rule which isn't vectorized
+    rare_words = ("least", "never")
+    # Number of distinct tokens remembered between batches
+    max_vocab = 1<<20
+
+    def __init__(self, sid):
+        self.sid = sid
+        self.lexicon = sid.lexicon
+        # The VADER constants moved into a class in later nltk versions
+        self.constants = getattr(sid, "constants", vader)
+        c = self.constants
+        self.punc_list = set(c.PUNC_LIST)
+
+        punc = re.escape(string.punctuation)
+        self.lead_punc = re.compile("([{0}]+)([^{0}]+)$".format(punc))
+        self.trail_punc = re.compile("([^{0}]+)([{0}]+)$".format(punc))
+        # Idioms and multi-word boosters ("kind of"), which trigger
+        # VADER's idiom rule
+        multiword = [k for k in itertools.chain(c.SPECIAL_CASE_IDIOMS, c.BOOSTER_DICT) if " " in k]
+        self.multiword = re.compile("(?:^| )(?:{})(?= |$)".format(
+            "|".join(re.escape(k) for k in multiword)))
+
+        # Later nltk versions lower-case the words when looking for "but"
+        self.but_ignores_case = self._reference("good But bad") != self._reference("good bad")
+        # Whether a repeated word is scored in the context of its first
+        # occurrence (VADER uses list.index() to find its position)
+        self.first_index_context = self._reference("good not good") == self._reference("good good")
+
+        self._clear_vocab()
+        self.exact = True
+        if self.compounds(probe_sentences) != [self._reference(s) for s in probe_sentences]:
+            warnings.warn("BatchScorer does not match this version of VADER; "
+                "falling back to scoring one sentence at a time")
+            self.exact = False
+
+    def _clear_vocab(self):
+        # raw whitespace-separated token -> id of the token VADER sees
+        self.token_ids = {}
+        # token -> id
+        self.vocab = {}
+        self.words = []
+        # property name -> array indexed by token id
+        self.features = {}
+        self._new_words = []
+
+    def _reference(self, s):
+        return self.sid.polarity_scores(s)["compound"]
+
+    def _strip_punc(self, w):
+        """Strip leading or trailing punctuation off a token the same way
+        as VADER's SentiText does.
+        """
+        if w[0] in string.punctuation:
+            m = self.lead_punc.match(w)
+            if m and m.group(1) in self.punc_list and len(m.group(2)) > 1:
+                return m.group(2)
+        elif w[-1] in string.punctuation:
+            m = self.trail_punc.match(w)
+            if m and m.group(2) in self.punc_list and len(m.group(1)) > 1:
+                return m.group(1)
+        return w
+
+    def _token_id(self, w):
+        tid = self.token_ids.get(w)
+        if tid is None:
+            token = self._strip_punc(w)
+            tid = self.vocab.get(token)
+            if tid is None:
+                tid = len(self.words)
+                self.vocab[token] = tid
+                self.words.append(token)
+                self._new_words.append(token)
+            self.token_ids[w] = tid
+        return tid
+
+    def _update_features(self):
+        """Compute the per-word properties of all words seen since the last call"""
+        if not self._new_words:
+            return
+        c = self.constants
+        new = {}
+        for w in self._new_words:
+            lower = w.lower()
+            for name, value in (
+                    ("valence", self.lexicon.get(lower, 0.0)),
+                    ("in_lex", lower in self.lexicon),
+                    ("booster", c.BOOSTER_DICT.get(lower, 0.0)),
+                    ("is_booster", lower in c.BOOSTER_DICT),
+                    ("upper", w.isupper()),
+                    ("negated", bool(c.negated([w]))),
+                    ("so_this", w in ("so", "this")),
+                    ("kind", lower == "kind"),
+                    ("of", lower == "of"),
+                    ("but", lower == "but" if self.but_ignores_case else w == "but"),
+                    ("BUT", w == "BUT"),
+                    ("rare", lower in self.rare_words),
+                    ):
+                new.setdefault(name, []).append(value)
+        for name, values in new.items():
+            values = np.array(values)
+            if name in self.features:
+                values = np.concatenate((self.features[name], values))
+            self.features[name] = values
+        self._new_words = []
+
+    def compounds(self, sentences):
+        """Return the VADER compound score of each sentence"""
+        if not self.exact:
+            return [self._reference(s) for s in sentences]
+        if not sentences:
+            return []
+        if len(self.token_ids) > self.max_vocab:
+            # Don't let the typos of every story pile up in long-lived workers
+            self._clear_vocab()
+
+        # Tokenize every sentence, and flag the ones that need the
+        # reference implementation
+        token_lists = []
+        fallback = np.zeros(len(sentences), dtype=bool)
+        for sno, s in enumerate(sentences):
+            ids = [self._token_id(w) for w in s.split() if len(w) > 1]
+            token_lists.append(ids)
+            if len(ids) > 1 and self.multiword.search(" ".join(self.words[i] for i in ids)):
+                fallback[sno] = True
+        self._update_features()
+        f = self.features
+
+        lengths = np.array([len(ids) for ids in token_lists])
+        tok = np.fromiter(itertools.chain.from_iterable(token_lists), dtype=np.int64, count=lengths.sum())
+        sent = np.repeat(np.arange(len(sentences)), lengths)
+        starts = np.cumsum(lengths) - lengths
+        pos = np.arange(len(tok)) - starts[sent]
+        num = len(sentences)
+
+        laden = f["in_lex"][tok] & ~f["is_booster"][tok]
+        fallback[sent[f["rare"][tok]]] = True
+
+        idx = np.arange(len(tok))
+        if self.first_index_context:
+            # VADER looks at the context of a word's *first* occurrence
+            # in the sentence, even when scoring later occurrences of it
+            keys = sent*len(self.words) + tok
+            _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            ctx = first[inverse.ravel()]
+        else:
+            ctx = idx
+        ctx_pos = pos[ctx]
+
+        # Some but not all words in ALL CAPS
+        upper = f["upper"][tok]
+        num_upper = np.bincount(sent, weights=upper, minlength=num)
+        cap_diff = ((lengths - num_upper > 0) & (lengths - num_upper < lengths))[sent]
+
+        # "kind of" isn't scored as "kind"
+        kind_of = np.zeros(len(tok), dtype=bool)
+        kind_of[:-1] = f["kind"][tok[:-1]] & f["of"][tok[1:]] & (sent[:-1] == sent[1:])
+        scored = laden & ~kind_of[ctx]
+
+        c = self.constants
+        valence = np.where(scored, f["valence"][tok], 0.0)
+        emph = scored & upper & cap_diff
+        valence[emph] += np.where(valence[emph] > 0, c.C_INCR, -c.C_INCR)
+
+        # Boosters and negations among the three preceding words
+        for start_i, damping in ((0, 1.0), (1, 0.95), (2, 0.9)):
+            prev = tok[np.maximum(ctx - (start_i + 1), 0)]
+            has = scored & (ctx_pos > start_i) & ~f["in_lex"][prev]
+            s = np.where(valence < 0, -f["booster"][prev], f["booster"][prev])
+            cap_boost = f["is_booster"][prev] & f["upper"][prev] & cap_diff
+            s += np.where(cap_boost, np.where(valence > 0, c.C_INCR, -c.C_INCR), 0.0)
+            valence = np.where(has, valence + s*damping, valence)
+
+            negate = f["negated"][prev]
+            if start_i == 2:
+                # "so" or "this" right before the word replaces the negation
+                so_this = has & f["so_this"][tok[ctx - 1]]
+                valence = np.where(so_this, valence*1.25, valence)
+                has &= ~so_this
+            valence = np.where(has & negate, valence*c.N_SCALAR, valence)
+
+        # Words before "but" count for half, words after it for 1.5x
+        nowhere = np.iinfo(np.int64).max
+        bi = np.full(num, nowhere)
+        np.minimum.at(bi, sent[f["but"][tok]], pos[f["but"][tok]])
+        if not self.but_ignores_case:
+            bi_upper = np.full(num, nowhere)
+            np.minimum.at(bi_upper, sent[f["BUT"][tok]], pos[f["BUT"][tok]])
+            bi = np.where(bi == nowhere, bi_upper, bi)
+            # Older versions find each word's position with list.index(),
+            # which goes wrong as soon as two words end up with the same
+            # valence; leave anything with more than one of them to VADER
+            in_but = (bi != nowhere)[sent] & (valence != 0)
+            fallback[np.bincount(sent[in_but], minlength=num) > 1] = True
+        bi = bi[sent]
+        has_but = bi != nowhere
+        valence = np.where(has_but & (pos < bi), valence*0.5, valence)
+        valence = np.where(has_but & (pos > bi), valence*1.5, valence)
+
+        sum_s = np.bincount(sent, weights=valence, minlength=num)
+
+        # Emphasis from exclamation and question marks
+        ep = np.minimum([s.count("!") for s in sentences], 4)*0.292
+        qm = np.array([s.count("?") for s in sentences])
+        qm = np.where(qm > 1, np.where(qm <= 3, qm*0.18, 0.96), 0)
+        amplifier = ep + qm
+        sum_s = np.where(sum_s > 0, sum_s + amplifier, np.where(sum_s < 0, sum_s - amplifier, sum_s))
+
+        compound = sum_s / np.sqrt(sum_s*sum_s + 15)
+        results = [round(x, 4) for x in compound.tolist()]
+        for sno in np.flatnonzero(fallback):
+            results[sno] = self._reference(sentences[sno])
+        return results
+
+def conformance(scorer, sentences):
+    """Compare the batch scores of sentences to the reference ones.
+    Returns (max absolute difference, time of batch, time of reference).
+    """
+    t0 = time.perf_counter()
+    batch = scorer.compounds(sentences)
+    t1 = time.perf_counter()
+    reference = [scorer._reference(s) for s in sentences]
+    t2 = time.perf_counter()
+    diff = max((abs(a-b) for a, b in zip(batch, reference)), default=0)
+    return diff, t1-t0, t2-t1
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: {} <input txt file>".format(sys.argv[0]))
+    else:
+        from nltk import tokenize
+        from common import attribute_sentence_to_char
+        sentences = tokenize.sent_tokenize(open(sys.argv[1]).read())
+        sentences = [attribute_sentence_to_char(s)[1] for s in sentences]
+        scorer = BatchScorer(vader.SentimentIntensityAnalyzer())
+        diff, t_batch, t_ref = conformance(scorer, sentences)
+        print("{} sentences, max difference {:.6f}".format(len(sentences), diff))
+        print("batch: {:.3f}s, reference: {:.3f}s".format(t_batch, t_ref))
@@ -0,0 +1,67 @@
+"""Regression test for the scoring of overlong sentences, such as those
+of "The Longest Trollfic Ever", which VADER used to seem to hang on.
+"""
+
+import math, os, random, sys, time, unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import analyze_senti
+
+words = ("and", "then", "it", "was", "very", "good", "bad", "so", "not", "happy",
+    "sad", "the", "pony", "said", "LOL", "trolled", "but", "really", "great", "awful")
+
+def trollfic_sentence(length, seed=0):
+    """Return a sentence of about length chars with no full stop in it,
+    only the odd comma
+    """
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    while size < length:
+        word = rng.choice(words) + ("," if rng.random() < 0.05 else "")
+        parts.append(word)
+        size += len(word) + 1
+    return " ".join(parts) + "!"
+
+def score(s):
+    """Return the compound score of the single sentence s, and the time
+    it took to score, without the help of the score cache
+    """
+    with mock.patch.object(analyze_senti, "score_cache", analyze_senti.ScoreCache()):
+        senti = analyze_senti.new_senti()
+        start = time.perf_counter()
+        analyze_senti.add_senti(senti, set(), s)
+        result = analyze_senti.finish_senti(senti)
+    return result["sentiment"]["text"]["avg"], time.perf_counter() - start
+
+class TestLongSentences(unittest.TestCase):
+    def test_scored(self):
+        compound, seconds = score(trollfic_sentence(100000))
+        self.assertTrue(math.isfinite(compound))
+        self.assertTrue(-1 <= compound <= 1)
+
+    def test_linear(self):
+        # Best of a few runs, to not be thrown off by a busy machine
+        short = min(score(trollfic_sentence(100000, seed))[1] for seed in range(3))
+        long = min(score(trollfic_sentence(400000, seed))[1] for seed in range(3))
+        # 4x as long: quadratic growth would take 16x as long
+        self.assertLess(long/short, 8)
+
+    def test_over_budget(self):
+        s = trollfic_sentence(100000)
+        with mock.patch.object(analyze_senti, "story_budget", -1), \
+                mock.patch.object(analyze_senti, "score_cache", analyze_senti.ScoreCache()):
+            senti = analyze_senti.new_senti()
+            analyze_senti.add_senti(senti, set(), "A short sentence.")
+            analyze_senti.score_pending(senti)
+            self.assertTrue(senti["over_budget"])
+            analyze_senti.add_senti(senti, set(), s)
+            raw = analyze_senti.finish_senti(senti)["sentiment"]["text"]["raw"]
+        # The sentence is still scored, by its first window
+        self.assertEqual(len(raw), 2)
+        window, = analyze_senti.split_clauses(s[:analyze_senti.window_size+1])[:1]
+        self.assertEqual(raw[1], score(window)[0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""Golden test of the word counts of analyze_words against the original
+word_tokenize-based pipeline.
+"""
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from nltk import tokenize
+import analyze_words
+from common import attribute_sentence_to_char, characters_plus_text
+
+corpus_path = os.path.join(os.path.dirname(__file__), "data", "words_corpus.txt")
+
+def original_counts(sentences):
+    """Count the words of the (characters, sentence) pairs the way
+    analyze_words originally did
+    """
+    associations = {c: {} for c in characters_plus_text}
+    for c_in_s, s in sentences:
+        words = []
+        for w in tokenize.word_tokenize(s.lower().replace("'", '`')):
+            w = w.replace("`", "'")
+            w = "".join(l for l in w if l in "abcdefghijklmnopqrstuvwxyz-'")
+            w = w.strip("'").strip("-").strip("'")
+            if w: words.append(w)
+        for c in tuple(c_in_s) + ("text",):
+            for word in words:
+                associations[c][word] = associations[c].get(word, 0) + 1
+    return associations
+
+class TestWordCounts(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # One sentence (or a few, which Punkt has to split) per line
+        lines = open(corpus_path).read().splitlines()
+        cls.sentences = [attribute_sentence_to_char(line) for line in lines]
+
+    def test_exact(self):
+        self.assertTrue(analyze_words.word_tokenizer.exact)
+
+    def test_counts(self):
+        words = analyze_words.new_words()
+        for c_in_s, s in self.sentences:
+            analyze_words.add_words(words, c_in_s, s)
+        expected = original_counts(self.sentences)
+        for c in characters_plus_text:
+            # Same counts, in the same order
+            self.assertEqual(list(words["associations"][c].items()), list(expected[c].items()), c)
+
+    def test_lower_cased_lines(self):
+        # Lower-cased text looks like more sentences to Punkt
+        sentences = [(c_in_s, s.lower()) for c_in_s, s in self.sentences]
+        words = analyze_words.new_words()
+        for c_in_s, s in sentences:
+            analyze_words.add_words(words, c_in_s, s)
+        self.assertEqual(dict(words["associations"]["text"]), original_counts(sentences)["text"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+"""Round-trip test of the .results format against the JSON layout of the
+.sentiment.json and .words.json files it replaced.
+"""
+
+import json, os, sys, tempfile, unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from analyze import analyze_sentences
+from results import read_results, write_results
+
+corpus_path = os.path.join(os.path.dirname(__file__), "data", "words_corpus.txt")
+
+class TestResults(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(corpus_path) as f:
+            cls.senti, cls.words = analyze_sentences(f.read().splitlines())
+        # What analyze.py --json writes and aggregate used to read
+        cls.senti_json = json.loads(json.dumps(cls.senti))
+        cls.words_json = json.loads(json.dumps(cls.words))
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "story.results")
+
+    def round_trip(self, senti, words, sparse=False):
+        write_results(self.path, senti, words)
+        return read_results(self.path, sparse)
+
+    def test_sentiment(self):
+        senti, _ = self.round_trip(self.senti, self.words)
+        self.assertEqual(senti.keys(), self.senti_json.keys())
+        self.assertEqual(list(senti["sentiment"]), list(self.senti_json["sentiment"]))
+        for c, p in self.senti_json["sentiment"].items():
+            self.assertEqual(senti["sentiment"][c]["avg"], p["avg"], c)
+            # Sentence sentiments are stored as float32
+            np.testing.assert_array_equal(senti["sentiment"][c]["raw"], np.asarray(p["raw"], dtype="<f4"), c)
+
+    def test_words(self):
+        _, words = self.round_trip(self.senti, self.words)
+        self.assertEqual(words, self.words_json)
+        for c, counts in self.words_json["associations"].items():
+            # Same counts, in the same order
+            self.assertEqual(list(words["associations"][c].items()), list(counts.items()), c)
+
+    def test_sparse(self):
+        _, words = self.round_trip(self.senti, self.words, sparse=True)
+        self.assertEqual(words["char_pairs"], self.words_json["char_pairs"])
+        for c, counts in self.words_json["associations"].items():
+            idx, num = words["associations"][c]
+            self.assertEqual(dict(zip([words["words"][i] for i in idx], num.tolist())), counts, c)
+
+    def test_empty_story(self):
+        senti, words = analyze_sentences([])
+        read_senti, read_words = self.round_trip(senti, words)
+        self.assertEqual(read_words, json.loads(json.dumps(words)))
+        for c, p in senti["sentiment"].items():
+            self.assertEqual(len(read_senti["sentiment"][c]["raw"]), len(p["raw"]))
+        _, sparse_words = self.round_trip(senti, words, sparse=True)
+        self.assertEqual(sparse_words["words"], [])
+
+    def test_not_results(self):
+        with open(self.path, "w") as f:
+            f.write(json.dumps(self.senti_json))
+        with self.assertRaises(ValueError):
+            read_results(self.path)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""Conformance test of vader_batch.BatchScorer against VADER's own
+polarity_scores, sentence by sentence.
+"""
+
+import itertools, os, sys, unittest, warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import vader_batch
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", UserWarning)
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+# Sentences exercising each of VADER's rules
+corpus = [
+    # Plain valence
+    "it smiled.", "This is good.", "This is bad.", "The cake was a cake.",
+    "it was happy and sad and angry and calm.",
+    # Boosters and dampeners
+    "This is very good.", "This is extremely bad.", "it is kind of nice.",
+    "it was sort of awful, barely ok and hardly happy.",
+    "Totally awesome, utterly dreadful, incredibly sweet.",
+    "it was so so so good.",
+    # Negation
+    "This is not good.", "This isn't bad at all.", "it never was happy.",
+    "Nobody is nice; nothing is great, without doubt.",
+    "it was not very good, not so bad, not the least bit scary.",
+    "Don't be sad, it wasn't terrible, it couldn't be worse.",
+    # "but"
+    "it was good but bad.", "Good, BUT bad.", "good But bad",
+    "But it was a good day. But a bad night?",
+    "it was awful but the ending was great but short.",
+    # ALL-CAPS emphasis
+    "it is GOOD.", "HAPPY DAYS ARE HERE.", "it was GREAT but i was SAD.",
+    "That is VERY BAD, not GOOD at ALL.",
+    # "least"
+    "it was the least bit happy.", "at least it was nice.", "least good of all.",
+    "it was least amusing.",
+    # Idioms
+    "That was the bomb!", "it was a hard rock song.", "it will kiss of death.",
+    "the party was yeah right.", "it was cut the mustard, but bad.",
+    "that's the shit, truly.", "it had a hand to mouth life.",
+    # Exclamation and question marks
+    "Good!", "Good!!", "Good!!!!!!", "Bad?", "Bad??", "Bad???", "Bad?????",
+    "Why?? Why would you do this??? I hate it!!!!!",
+    "is it nice?!?!", "No!",
+    # Punctuation around words, emoticons, odd spacing
+    "\"Wonderful,\" it said; 'terrible.' (awful) -- ok...",
+    ":) it was fun :(", "  good   bad  ", "", "!!!", "?",
+    "it was never so nice, nor kind.",
+]
+
+def combined(sentences):
+    """Return pairs of the corpus joined, so that rules meet each other"""
+    return [a + " " + b for a, b in itertools.islice(itertools.permutations(sentences, 2), 0, None, 7)]
+
+class TestBatchScorer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.sid = SentimentIntensityAnalyzer()
+        cls.scorer = vader_batch.BatchScorer(cls.sid)
+
+    def reference(self, sentences):
+        return [self.sid.polarity_scores(s)["compound"] for s in sentences]
+
+    def test_exact(self):
+        # The probe sentences agree with this version of VADER
+        self.assertTrue(self.scorer.exact)
+
+    def test_corpus(self):
+        self.assertEqual(self.scorer.compounds(corpus), self.reference(corpus))
+
+    def test_combined(self):
+        sentences = combined(corpus)
+        self.assertEqual(self.scorer.compounds(sentences), self.reference(sentences))
+
+    def test_probes(self):
+        sentences = vader_batch.probe_sentences
+        self.assertEqual(self.scorer.compounds(sentences), self.reference(sentences))
+
+    def test_batches(self):
+        # Scores don't depend on what else is in the batch, or on the
+        # vocabulary remembered from earlier batches
+        scorer = vader_batch.BatchScorer(self.sid)
+        one_by_one = [scorer.compounds([s])[0] for s in corpus]
+        self.assertEqual(one_by_one, self.reference(corpus))
+
+if __name__ == "__main__":
+    unittest.main()